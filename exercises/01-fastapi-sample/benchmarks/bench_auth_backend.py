@@ -0,0 +1,39 @@
+"""AuthenticationBackend.authenticate() のスループットをクレームキャッシュの有無で比較
+
+    poetry run python -m benchmarks.bench_auth_backend --requests 20000
+"""
+import argparse
+import asyncio
+import time
+
+from starlette.requests import Request
+
+from sql_app.middlewares import AuthenticationBackend
+from sql_app.utils.jwt import jwt_encode
+
+
+async def run(backend: AuthenticationBackend, request: Request, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await backend.authenticate(request)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = jwt_encode({"user_id": 1})
+    request = Request({"type": "http", "headers": [(b"x-api-token", token.encode())]})
+
+    for name, backend in [
+        ("cache off", AuthenticationBackend(cache_size=0)),
+        ("cache on", AuthenticationBackend()),
+    ]:
+        elapsed = asyncio.run(run(backend, request, args.requests))
+        print(f"{name:<10} {args.requests / elapsed:12.0f} authenticate/s")
+
+
+if __name__ == "__main__":
+    main()
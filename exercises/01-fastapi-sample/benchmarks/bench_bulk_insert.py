@@ -0,0 +1,39 @@
+"""アイテムを1件ずつ登録した場合と一括登録した場合の所要時間を比較
+
+    poetry run python -m benchmarks.bench_bulk_insert --items 10000
+"""
+import argparse
+import time
+
+from sql_app import crud, schemas
+
+from .common import seed_users_and_items, temporary_session_factory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=10000)
+    args = parser.parse_args()
+
+    items = [schemas.ItemCreate(title=f"Item {i}", description=f"Description {i}") for i in range(args.items)]
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=2, items=0)
+
+        started = time.perf_counter()
+        for item in items:
+            crud.create_user_item(db, item, user_id=1)
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        crud.create_user_items(db, items, user_id=2)
+        bulk = time.perf_counter() - started
+        db.close()
+
+    print(f"single inserts {single:8.3f}s {args.items / single:10.0f} items/s")
+    print(f"bulk insert    {bulk:8.3f}s {args.items / bulk:10.0f} items/s")
+
+
+if __name__ == "__main__":
+    main()
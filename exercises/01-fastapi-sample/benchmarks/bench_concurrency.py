@@ -0,0 +1,82 @@
+"""スレッドプールのサイズ毎に、多数の同時接続クライアントでのRPSを比較
+
+    poetry run python -m benchmarks.bench_concurrency --clients 200 --threadpool-sizes 40 200
+"""
+import argparse
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import List
+
+import httpx
+
+from sql_app import crud
+from sql_app.config import settings
+from sql_app.database import get_db, get_read_db, get_write_session_scope
+from sql_app.main import app, configure_threadpool
+from sql_app.utils.jwt import jwt_encode
+
+from .common import seed_users_and_items, temporary_session_factory
+
+
+async def run_clients(clients: int, requests_per_client: int, path: str, token: str) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker() -> None:
+            for _ in range(requests_per_client):
+                response = await client.get(path, headers={"X-API-TOKEN": token})
+                assert response.status_code == 200, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        return time.perf_counter() - started
+
+
+async def bench(threadpool_sizes: List[int], clients: int, requests_per_client: int, path: str, token: str) -> None:
+    for size in threadpool_sizes:
+        settings.threadpool_size = size
+        await configure_threadpool()
+        crud.active_user_cache.clear()
+        elapsed = await run_clients(clients, requests_per_client, path, token)
+        total = clients * requests_per_client
+        print(f"threadpool={size:<5} clients={clients:<5} {total / elapsed:10.1f} req/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--threadpool-sizes", type=int, nargs="+", default=[40, 200])
+    parser.add_argument("--path", default="/items/?limit=20")
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=100, items=10000)
+        db.close()
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        @contextmanager
+        def write_session_scope(key=None):
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_read_db] = override_get_db
+        app.dependency_overrides[get_write_session_scope] = lambda: write_session_scope
+        token = jwt_encode({"user_id": 1})
+        asyncio.run(bench(args.threadpool_sizes, args.clients, args.requests_per_client, args.path, token))
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""SQLiteのPRAGMA設定(WAL, synchronous=NORMAL, busy_timeout)の有無で同時書き込みのスループットを比較
+
+    poetry run python -m benchmarks.bench_concurrent_writers --writers 8 --items-per-writer 200
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from sql_app import crud, schemas
+from sql_app.config import Settings
+
+from .common import seed_users_and_items, temporary_session_factory
+
+PROFILES = {
+    "sqlite defaults": Settings(sqlite_wal=False, sqlite_synchronous=None, sqlite_busy_timeout_ms=None, sqlite_mmap_size=0),
+    "wal + normal": Settings(),
+}
+
+
+def run(options: Settings, writers: int, items_per_writer: int) -> None:
+    with temporary_session_factory(options=options) as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=writers, items=0)
+        db.close()
+
+        errors = []
+
+        def writer(user_id: int) -> None:
+            db = session_factory()
+            try:
+                for i in range(items_per_writer):
+                    try:
+                        crud.create_user_item(db, schemas.ItemCreate(title=f"Item {i}"), user_id=user_id)
+                    except OperationalError as e:
+                        db.rollback()
+                        errors.append(e)
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=writer, args=(user_id,)) for user_id in range(1, writers + 1)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        committed = writers * items_per_writer - len(errors)
+        print(f"{committed / elapsed:10.1f} commits/s  errors={len(errors)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--items-per-writer", type=int, default=200)
+    args = parser.parse_args()
+
+    for name, options in PROFILES.items():
+        print(f"{name:<16}", end=" ", flush=True)
+        run(options, args.writers, args.items_per_writer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""ユーザー非アクティブ化中に、他の書き込みが待たされる時間(書き込みロックの保持時間)をバッチサイズ毎に比較
+
+    poetry run python -m benchmarks.bench_deactivate_lock --items 300000 --batch-sizes 0 1000 10000
+"""
+import argparse
+import threading
+import time
+
+from sql_app import crud, schemas
+
+from .common import seed_users_and_items, temporary_session_factory
+
+
+def run(items: int, batch_size: int) -> None:
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        # memo: seed はアイテムを owner_id = i % users + 1 に割り当てるため、users=1 で全件をユーザー1の所有にする
+        seed_users_and_items(db, users=1, items=items)
+        db.execute("INSERT INTO users (id, email, hashed_password, is_active) VALUES (2, 'transfer@example.com', 'hashed', 1)")
+        db.commit()
+        db.close()
+
+        done = threading.Event()
+        latencies = []
+
+        def writer() -> None:
+            db = session_factory()
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    crud.create_user_item(db, schemas.ItemCreate(title="concurrent"), user_id=2)
+                    latencies.append(time.perf_counter() - started)
+                    time.sleep(0.001)
+            finally:
+                db.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        db = session_factory()
+        started = time.perf_counter()
+        assert crud.deactivate_user(db, user_id=1, transfer_user_id=2, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        done.set()
+        thread.join()
+        db.close()
+
+    print(
+        f"batch_size={batch_size:<7} total={elapsed:7.3f}s "
+        f"concurrent writes={len(latencies):<6} max write wait={max(latencies) * 1000:9.1f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=300000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[0, 1000, 10000])
+    args = parser.parse_args()
+
+    for batch_size in args.batch_sizes:
+        run(args.items, batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""同じページを繰り返しポーリングした場合に、If-None-Match(304)で削減できる転送量とレイテンシの比較
+
+    poetry run python -m benchmarks.bench_etag --items 20000 --limit 100 --repeat 200
+"""
+import argparse
+
+from fastapi.testclient import TestClient
+
+from sql_app.database import get_db, get_read_db
+from sql_app.dependencies.auth_dependency import verify_active_user
+from sql_app.main import app
+
+from .common import measure, report, seed_users_and_items, temporary_session_factory
+
+
+def poll(client: TestClient, path: str, repeat: int, conditional: bool) -> None:
+    etag = client.get(path).headers["ETag"]
+    headers = {"If-None-Match": etag} if conditional else {}
+    sizes = []
+
+    def request() -> None:
+        response = client.get(path, headers=headers)
+        assert response.status_code == (304 if conditional else 200)
+        sizes.append(len(response.content) + sum(len(k) + len(v) for k, v in response.headers.items()))
+
+    samples = measure(request, repeat)
+    mode = "If-None-Match" if conditional else "unconditional"
+    report(f"{path} {mode}", samples)
+    print(f"{'':<32} bytes/response={sum(sizes) / len(sizes):,.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=args.users, items=args.items)
+        db.close()
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_read_db] = override_get_db
+        app.dependency_overrides[verify_active_user] = lambda: None
+        client = TestClient(app)
+        print(f"items={args.items} users={args.users} limit={args.limit}")
+        # ユーザーは所有するアイテム(items/users件)も含めて返す
+        for path in ["/users/1", f"/items/?limit={args.limit}"]:
+            for conditional in (False, True):
+                poll(client, path, args.repeat, conditional)
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""/health-check のRPSを、全リクエストで認証する従来のミドルウェア構成と、ルート毎に認証する現在の構成で比較
+
+    poetry run python -m benchmarks.bench_health_check --requests 5000 --concurrency 20
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import httpx
+from starlette.middleware.authentication import AuthenticationMiddleware
+from starlette.types import ASGIApp
+
+from sql_app.database import get_db, get_read_db
+from sql_app.main import app
+from sql_app.middlewares import AuthenticationBackend
+from sql_app.utils.jwt import jwt_encode
+
+from .common import temporary_session_factory
+
+
+async def run(asgi_app: ASGIApp, requests: int, concurrency: int, headers: dict) -> float:
+    counter = itertools.count()
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while next(counter) < requests:
+            response = await client.get("/health-check", headers=headers)
+            assert response.status_code == 200, response.text
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_read_db] = override_get_db
+        # memo: 変更前の構成(全リクエストで AuthenticationMiddleware がトークンを検証する)を再現する
+        setups = [
+            ("global middleware", AuthenticationMiddleware(app, backend=AuthenticationBackend())),
+            ("route-aware", app),
+        ]
+        token = jwt_encode({"user_id": 1})
+        try:
+            for header_name, headers in [("no token", {}), ("with token", {"X-API-TOKEN": token})]:
+                for name, asgi_app in setups:
+                    rps = asyncio.run(run(asgi_app, args.requests, args.concurrency, headers))
+                    print(f"{name:<18} {header_name:<11} rps={rps:9.1f}", flush=True)
+        finally:
+            app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
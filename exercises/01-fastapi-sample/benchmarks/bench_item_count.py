@@ -0,0 +1,36 @@
+"""ユーザーの所有アイテム数の取得について、users.item_count(主キーの1行)と COUNT(*) の比較
+
+    poetry run python -m benchmarks.bench_item_count --users 10 --items 200000
+"""
+import argparse
+
+from sql_app import crud, models
+
+from .common import measure, report, seed_users_and_items, temporary_session_factory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=args.users, items=args.items)
+        # シードはSQLで直接登録するため、所有アイテム数を集計しておく
+        crud.rebuild_item_counts(db)
+
+        def count_items():
+            return db.query(models.Item).filter(models.Item.owner_id == 1).count()
+
+        assert crud.get_user_stats(db, user_id=1).item_count == count_items()
+        print(f"items={args.items} users={args.users} items/user={args.items // args.users}")
+        report("users.item_count", measure(lambda: crud.get_user_stats(db, user_id=1), args.repeat))
+        report("COUNT(*) by owner_id", measure(count_items, args.repeat))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
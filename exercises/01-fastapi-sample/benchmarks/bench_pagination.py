@@ -0,0 +1,37 @@
+"""offset ページネーションとカーソルページネーションの深いページでのレイテンシ比較
+
+    poetry run python -m benchmarks.bench_pagination --items 200000 --page 1000
+"""
+import argparse
+
+from sql_app import crud
+
+from .common import measure, report, seed_users_and_items, temporary_session_factory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=args.users, items=args.items)
+
+        skip = (args.page - 1) * args.limit
+        # memo: カーソルモードでは前ページ末尾のidを起点にするため、事前に1回offsetで取得して起点を決める
+        after_id = crud.get_items(db, skip=skip - 1, limit=1)[0].id
+        db.expunge_all()
+
+        print(f"items={args.items} page={args.page} limit={args.limit}")
+        report("offset (skip/limit)", measure(lambda: crud.get_items(db, skip=skip, limit=args.limit), args.repeat))
+        report("cursor (id > after_id)", measure(lambda: crud.get_items(db, after_id=after_id, limit=args.limit), args.repeat))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""パスワードハッシュのプロセス数毎に、同時実行時のユーザー作成スループットを比較
+
+    poetry run python -m benchmarks.bench_password_hashing --signups 64 --workers 0 1 2 4
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sql_app import crud, schemas
+from sql_app.config import settings
+from sql_app.utils.password import shutdown_executor
+
+from .common import temporary_session_factory
+
+
+def run(workers: int, signups: int, threads: int) -> None:
+    settings.password_hash_workers = workers
+    with temporary_session_factory() as session_factory:
+        def signup(i: int) -> None:
+            db = session_factory()
+            try:
+                crud.create_user(db, schemas.UserCreate(email=f"user{i}@example.com", password=f"password{i}"))
+            finally:
+                db.close()
+
+        # memo: プロセスの起動時間を計測に含めないよう、事前に1件作成してプールを立ち上げておく
+        signup(-1)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            started = time.perf_counter()
+            list(pool.map(signup, range(signups)))
+            elapsed = time.perf_counter() - started
+    shutdown_executor()
+    print(f"workers={workers:<3} {signups / elapsed:8.1f} signups/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signups", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        run(workers, args.signups, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""FTS5による全文検索とLIKEによる全件走査のレイテンシを比較
+
+    poetry run python -m benchmarks.bench_search --items 1000000
+"""
+import argparse
+
+from sql_app import crud, models
+
+from .common import measure, report, seed_users_and_items, temporary_session_factory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--query", default="Description 123456")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=100, items=args.items)
+
+        pattern = f"%{args.query}%"
+
+        def like_scan():
+            return (
+                db.query(models.Item)
+                .filter(models.Item.title.like(pattern) | models.Item.description.like(pattern))
+                .order_by(models.Item.id.asc())
+                .limit(args.limit)
+                .all()
+            )
+
+        def fts5():
+            return crud.search_items(db, query=args.query, limit=args.limit)
+
+        print(f"items={args.items} query={args.query!r} like hits={len(like_scan())} fts5 hits={len(fts5())}")
+        report("LIKE scan", measure(like_scan, args.repeat))
+        report("FTS5 MATCH (bm25)", measure(fts5, args.repeat))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""1000行の /items/ ページについて、レスポンスのシリアライズ方法毎に1リクエストあたりのCPU時間を比較
+
+    poetry run python -m benchmarks.bench_serialization --rows 1000 --requests 200 [--profile]
+
+設定は起動時に読み込まれるため、各モードは環境変数を変えた子プロセスで計測する。
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import subprocess
+import sys
+import time
+
+MODES = {
+    "stdlib json + validation": {"SQL_APP_ORJSON_RESPONSE": "false", "SQL_APP_SKIP_RESPONSE_VALIDATION": "false"},
+    "orjson + validation": {"SQL_APP_ORJSON_RESPONSE": "true", "SQL_APP_SKIP_RESPONSE_VALIDATION": "false"},
+    "orjson + skip validation": {"SQL_APP_ORJSON_RESPONSE": "true", "SQL_APP_SKIP_RESPONSE_VALIDATION": "true"},
+}
+
+
+def child(rows: int, requests: int, profile: bool) -> None:
+    from fastapi.testclient import TestClient
+
+    from sql_app.database import get_db, get_read_db
+    from sql_app.dependencies.auth_dependency import verify_active_user
+    from sql_app.main import app
+
+    from .common import seed_users_and_items, temporary_session_factory
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=10, items=rows)
+        db.close()
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_read_db] = override_get_db
+        app.dependency_overrides[verify_active_user] = lambda: None
+        client = TestClient(app)
+        path = f"/items/?limit={rows}"
+        assert len(client.get(path).json()) == rows
+
+        profiler = cProfile.Profile() if profile else None
+        started = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        for _ in range(requests):
+            client.get(path)
+        if profiler is not None:
+            profiler.disable()
+        elapsed = time.process_time() - started
+
+    if profiler is not None:
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+    print(json.dumps({"cpu_ms_per_request": elapsed / requests * 1000}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.rows, args.requests, args.profile)
+        return
+
+    for name, env in MODES.items():
+        command = [sys.executable, "-m", "benchmarks.bench_serialization", "--child"]
+        command += ["--rows", str(args.rows), "--requests", str(args.requests)]
+        if args.profile:
+            command.append("--profile")
+        output = subprocess.run(
+            command, env={**os.environ, **env}, check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{name:<28} {result['cpu_ms_per_request']:8.2f} ms CPU/request")
+
+
+if __name__ == "__main__":
+    main()
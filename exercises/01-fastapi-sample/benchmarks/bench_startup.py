@@ -0,0 +1,102 @@
+"""アプリケーションの起動時間(import・起動処理・最初のリクエストまで)の計測
+
+    poetry run python -m benchmarks.bench_startup --runs 5 [--top 15]
+
+各計測は新しいPythonプロセスで `python -X importtime` を付けて実行し、
+DBが空の場合(スキーマ作成あり)・作成済みの場合・スキーマの確認を無効化した場合を比較する。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from typing import Dict, List
+
+CHILD = """
+import json, time
+from fastapi.testclient import TestClient
+started = time.perf_counter()
+from sql_app.main import app
+imported = time.perf_counter()
+with TestClient(app) as client:
+    ready = time.perf_counter()
+    assert client.get("/health-check").status_code == 200
+    first = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_request_ms": (first - started) * 1000,
+}))
+"""
+
+
+def run_child(env: Dict[str, str]) -> Dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        env={**os.environ, **env},
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # "import time: self [us] | cumulative | imported package" の形式で、子のモジュールが親より先に出力される。
+    # テストクライアントなどの計測対象外のimportを除くため、sql_app.main の読み込み中にimportされたモジュールだけを集計する
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((name.strip(), len(name) - len(name.lstrip()), int(cumulative) / 1000))
+    modules = {}
+    end = next(i for i, (name, depth, _) in enumerate(entries) if name == "sql_app.main" and depth == 1)
+    for name, depth, ms in reversed(entries[:end + 1]):
+        if depth == 1 and name != "sql_app.main":
+            break
+        modules[name] = ms
+    timings["modules"] = modules
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = f"sqlite:///{os.path.join(tmpdir, 'startup.db')}"
+        db_file = os.path.join(tmpdir, "startup.db")
+        modes = {
+            "empty database": {"SQL_APP_DATABASE_URL": url},
+            "existing schema": {"SQL_APP_DATABASE_URL": url},
+            "schema_setup=false": {"SQL_APP_DATABASE_URL": url, "SQL_APP_SCHEMA_SETUP": "false"},
+        }
+        modules: Dict[str, List[float]] = defaultdict(list)
+        for name, env in modes.items():
+            results = []
+            for _ in range(args.runs):
+                if name == "empty database" and os.path.exists(db_file):
+                    os.remove(db_file)
+                results.append(run_child(env))
+            for module, ms in results[-1]["modules"].items():
+                modules[module].append(ms)
+            print(
+                f"{name:<20} "
+                + " ".join(
+                    f"{key}={statistics.median(r[key] for r in results):7.1f}ms"
+                    for key in ("import_ms", "startup_ms", "first_request_ms")
+                )
+            )
+
+    print("\nslowest imports (cumulative, median of modes):")
+    ranked = sorted(modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for module, samples in ranked[: args.top]:
+        print(f"  {statistics.median(samples):8.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""多数のクライアントが同時にアイテムを作成する場合の RPS を、書き込みをまとめる(coalescing)場合とまとめない場合で比較
+
+    poetry run python -m benchmarks.bench_write_coalescing --clients 100 --requests-per-client 20 --synchronous FULL
+
+コミット毎のfsyncの影響を見るため、既定では synchronous=FULL のSQLiteで計測する。
+"""
+import argparse
+import asyncio
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from sql_app import main
+from sql_app.config import Settings, settings
+from sql_app.database import get_db, get_read_db, get_write_session_scope
+from sql_app.dependencies.auth_dependency import verify_active_user
+from sql_app.main import app
+
+from .common import seed_users_and_items, temporary_session_factory
+
+
+async def run_clients(clients: int, requests_per_client: int, coalescing: bool) -> float:
+    settings.item_write_coalescing = coalescing
+    await main.start_item_writer()
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def worker(user_id: int) -> None:
+                for i in range(requests_per_client):
+                    response = await client.post(f"/users/{user_id}/items/", json={"title": f"Item {i}"})
+                    assert response.status_code == 200, response.text
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(n % 10 + 1) for n in range(clients)))
+            return time.perf_counter() - started
+    finally:
+        await main.stop_item_writer()
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests-per-client", type=int, default=20)
+    parser.add_argument("--synchronous", default="FULL")
+    parser.add_argument("--batch-ms", type=float, default=settings.item_write_batch_ms)
+    args = parser.parse_args()
+
+    settings.item_write_batch_ms = args.batch_ms
+    # 書き込みロック待ちのクエリがスロークエリとして大量に出力されるため無効化する
+    settings.slow_query_threshold_ms = None
+    options = Settings(sqlite_synchronous=args.synchronous)
+    for coalescing in (False, True):
+        with temporary_session_factory(options=options) as session_factory:
+            db = session_factory()
+            seed_users_and_items(db, users=10, items=0)
+            db.close()
+
+            def override_get_db():
+                db = session_factory()
+                try:
+                    yield db
+                finally:
+                    db.close()
+
+            @contextmanager
+            def write_session_scope(key=None):
+                db = session_factory()
+                try:
+                    yield db
+                finally:
+                    db.close()
+
+            app.dependency_overrides[get_db] = override_get_db
+            app.dependency_overrides[get_read_db] = override_get_db
+            app.dependency_overrides[get_write_session_scope] = lambda: write_session_scope
+            app.dependency_overrides[verify_active_user] = lambda: None
+            main.write_session_scope = write_session_scope
+            elapsed = asyncio.run(run_clients(args.clients, args.requests_per_client, coalescing))
+            app.dependency_overrides.clear()
+
+            total = args.clients * args.requests_per_client
+            db = session_factory()
+            stored = db.execute("SELECT count(*) FROM items").scalar()
+            db.close()
+            assert stored == total, (stored, total)
+            mode = "coalescing" if coalescing else "per-request commit"
+            print(f"{mode:<20} synchronous={args.synchronous:<6} {total / elapsed:10.1f} req/s")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,62 @@
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from sql_app import crud
+from sql_app.config import Settings, settings
+from sql_app.database import Base, create_db_engine
+
+
+@contextmanager
+def temporary_session_factory(url: str = "", options: Settings = settings) -> Iterator[sessionmaker]:
+    # memo: ベンチマークは本番・テスト用のDBを汚さないよう一時ファイルのSQLiteで実行する
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_db_engine(url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}", options)
+        Base.metadata.create_all(bind=engine)
+        try:
+            yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        finally:
+            engine.dispose()
+
+
+def seed_users_and_items(db: Session, users: int, items: int, chunk_size: int = 10000) -> None:
+    db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES (:id, :email, 'hashed', 1)",
+        [{"id": i, "email": f"user{i}@example.com"} for i in range(1, users + 1)],
+    )
+    for start in range(1, items + 1, chunk_size):
+        stop = min(start + chunk_size, items + 1)
+        db.execute(
+            "INSERT INTO items (id, title, description, owner_id) VALUES (:id, :title, :description, :owner_id)",
+            [
+                {"id": i, "title": f"Item {i}", "description": f"Description {i}", "owner_id": i % users + 1}
+                for i in range(start, stop)
+            ],
+        )
+    db.commit()
+    # アイテムを直接INSERTしているため、アプリと同じ状態になるよう users.item_count を実際の件数に合わせる
+    crud.rebuild_item_counts(db)
+
+
+def measure(fn: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def report(name: str, samples: List[float]) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:<32} n={len(samples):<5} "
+        f"median={statistics.median(ordered) * 1000:9.3f}ms "
+        f"p95={p95 * 1000:9.3f}ms"
+    )
@@ -0,0 +1,201 @@
+"""main.py の全ルートをプロセス内のASGIアプリに対して実行し、ルート毎のレイテンシ(p50/p95/p99)とRPSを計測する
+
+    poetry run python -m benchmarks.suite --users 1000 --items 100000 --output bench-results.json
+    poetry run python -m benchmarks.suite --baseline bench-baseline.json --threshold 0.2
+
+--baseline を指定した場合、p95 が threshold 以上悪化、または RPS が threshold 以上低下したルートを回帰として終了コード1で終了する。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from sql_app import crud
+from sql_app.database import get_db, get_read_db, get_write_session_scope
+from sql_app.main import app
+from sql_app.utils.jwt import jwt_encode
+from sql_app.utils.pagination import encode_cursor
+
+from .common import seed_users_and_items, temporary_session_factory
+
+Request = Tuple[str, str, Optional[Any]]
+
+
+def build_scenarios(users: int, items: int) -> Dict[str, Callable[[int], Request]]:
+    # 各シナリオは i 番目のリクエストの (メソッド, パス, JSON) を返す
+    signup_ids = itertools.count()
+    # memo: 非アクティブ化は破壊的なため、IDの大きいユーザーから順に1回ずつ対象にする(ユーザー1は最後まで残す)
+    deactivate_ids = itertools.count(users, -1)
+    return {
+        "GET /health-check": lambda i: ("GET", "/health-check", None),
+        "POST /users/": lambda i: ("POST", "/users/", {"email": f"bench{next(signup_ids)}@example.com", "password": "bench"}),
+        "GET /users/": lambda i: ("GET", "/users/?limit=100", None),
+        "GET /users/{user_id}": lambda i: ("GET", f"/users/{i % users + 1}", None),
+        "GET /users/{user_id}/stats": lambda i: ("GET", f"/users/{i % users + 1}/stats", None),
+        "GET /users/batch": lambda i: (
+            "GET",
+            "/users/batch?" + "&".join(f"ids={(i * 50 + n) % users + 1}" for n in range(50)),
+            None,
+        ),
+        "DELETE /users/{user_id}": lambda i: ("DELETE", f"/users/{max(next(deactivate_ids), 2)}", None),
+        "POST /users/{user_id}/items/": lambda i: ("POST", f"/users/{i % users + 1}/items/", {"title": f"Bench {i}"}),
+        "POST /users/{user_id}/items/bulk/": lambda i: (
+            "POST",
+            f"/users/{i % users + 1}/items/bulk/",
+            [{"title": f"Bulk {i}-{n}"} for n in range(100)],
+        ),
+        "GET /items/": lambda i: ("GET", "/items/?limit=100", None),
+        "GET /items/ (cursor)": lambda i: ("GET", f"/items/?limit=100&cursor={encode_cursor(i * 97 % max(items, 1))}", None),
+        "GET /items/search/": lambda i: ("GET", f"/items/search/?q=Item+{i % max(items, 1)}&limit=20", None),
+        "GET /me/items/": lambda i: ("GET", "/me/items/?limit=100", None),
+        "GET /export/users/": lambda i: ("GET", "/export/users/", None),
+        "GET /export/items/": lambda i: ("GET", "/export/items/", None),
+        "GET /metrics": lambda i: ("GET", "/metrics", None),
+    }
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: Callable[[int], Request], requests: int, concurrency: int, token: str
+) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in iter(lambda: next(counter), None):
+            if i >= requests:
+                return
+            method, path, body = scenario(i)
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body, headers={"X-API-TOKEN": token})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": len(ordered) / elapsed,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+
+
+async def run_suite(args: argparse.Namespace, token: str) -> Dict[str, Dict[str, float]]:
+    scenarios = build_scenarios(args.users, args.items)
+    selected = [name for name in scenarios if not args.routes or any(route in name for route in args.routes)]
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in selected:
+            requests = min(args.requests, args.users - 1) if name.startswith("DELETE") else args.requests
+            results[name] = await run_scenario(client, scenarios[name], requests, args.concurrency, token)
+            result = results[name]
+            print(
+                f"{name:<36} rps={result['rps']:9.1f} p50={result['p50_ms']:8.2f}ms "
+                f"p95={result['p95_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms errors={result['errors']}",
+                flush=True,
+            )
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("routes", {}).get(name)
+        if base is None:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms")
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {base['rps']:.1f} -> {result['rps']:.1f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--routes", nargs="*", help="only run routes whose name contains one of these strings")
+    parser.add_argument("--output", help="write results as JSON (usable as a later --baseline)")
+    parser.add_argument("--baseline", help="JSON written by a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    with temporary_session_factory() as session_factory:
+        db = session_factory()
+        seed_users_and_items(db, users=args.users, items=args.items)
+        db.close()
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        @contextmanager
+        def write_session_scope(key=None):
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_read_db] = override_get_db
+        app.dependency_overrides[get_write_session_scope] = lambda: write_session_scope
+        crud.active_user_cache.clear()
+        try:
+            results = asyncio.run(run_suite(args, jwt_encode({"user_id": 1})))
+        finally:
+            app.dependency_overrides.pop(get_db, None)
+            app.dependency_overrides.pop(get_read_db, None)
+            app.dependency_overrides.pop(get_write_session_scope, None)
+
+    report = {
+        "meta": {
+            "users": args.users,
+            "items": args.items,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "routes": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions detected:", *regressions, sep="\n  ")
+            sys.exit(1)
+        print(f"No regressions (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
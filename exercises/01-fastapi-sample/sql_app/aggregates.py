@@ -0,0 +1,34 @@
+import argparse
+import sys
+
+from sqlalchemy.orm import Session
+
+from . import crud
+
+
+def main() -> int:
+    # users.item_count と実際のアイテム数の整合性を確認し、--rebuild の場合は再計算する
+    parser = argparse.ArgumentParser(description="Check (and optionally rebuild) users.item_count")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    from .database import engine
+
+    db = Session(bind=engine)
+    try:
+        mismatches = crud.find_item_count_mismatches(db)
+        for user_id, stored, actual in mismatches:
+            print(f"user {user_id}: item_count={stored} actual={actual}")
+        if not mismatches:
+            print("item counts are consistent")
+            return 0
+        if args.rebuild:
+            print(f"rebuilt item counts for {crud.rebuild_item_counts(db)} users")
+            return 0
+        return 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,99 @@
-from sqlalchemy.orm import Session
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import and_, column, func, insert, or_, select, table, text
+from sqlalchemy.orm import Session, noload, selectinload
 
 from . import models, schemas
+from .config import settings
+from .utils.cache import create_cache
+from .utils.password import hash_password, needs_rehash, verify_password
+from .utils.search import LIKE_ESCAPE, build_match_query, escape_like
+
+# memo: 認証毎のアクティブ確認でDBへ問い合わせないよう、ユーザーIDをキーにアクティブ状態をキャッシュする
+ACTIVE_USER_CACHE_SIZE = 10000
+ACTIVE_USER_CACHE_TTL = 30.0
+active_user_cache = create_cache(
+    settings.cache_backend, maxsize=ACTIVE_USER_CACHE_SIZE, ttl=ACTIVE_USER_CACHE_TTL, path=settings.cache_path
+)
+
+# memo: 1行あたり3パラメータのため、古いSQLiteの変数上限(999)に収まるようにする
+BULK_INSERT_CHUNK_SIZE = 300
+EXPORT_CHUNK_SIZE = 1000
+# memo: IN句のパラメータ数も古いSQLiteの変数上限(999)に収まるようにする
+ID_LOOKUP_CHUNK_SIZE = 500
+
+items_fts = table("items_fts", column("rowid"), column("rank"))
 
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
 
+def get_user_version(db: Session, user_id: int) -> Optional[int]:
+    # ETagの確認用に、ユーザーとアイテムを読み込まずにバージョンだけを取得する
+    return db.query(models.User.version).filter(models.User.id == user_id).scalar()
+
+
+def get_user_stats(db: Session, user_id: int):
+    # memo: 所有するアイテム数は users.item_count に保持しているため、アイテムを数えずに主キーの1行だけを読む
+    return db.query(models.User.id, models.User.item_count).filter(models.User.id == user_id).first()
+
+
+def add_user_item_count(db: Session, user_id: int, delta: int) -> None:
+    # memo: アイテムの追加・移管と同じトランザクションで所有アイテム数を更新する。
+    #       ユーザーのレスポンスには所有するアイテムも含まれるため、ETag用のバージョンも加算する
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {"item_count": models.User.item_count + delta, "version": models.User.version + 1},
+        synchronize_session=False,
+    )
+
+
+def find_item_count_mismatches(db: Session) -> List[Tuple[int, int, int]]:
+    # users.item_count と実際のアイテム数が一致しないユーザーの (id, item_count, 実際の件数) を返す
+    actual = func.count(models.Item.id)
+    return [
+        tuple(row)
+        for row in db.query(models.User.id, models.User.item_count, actual)
+        .outerjoin(models.Item, models.Item.owner_id == models.User.id)
+        .group_by(models.User.id, models.User.item_count)
+        .having(models.User.item_count != actual)
+        .order_by(models.User.id.asc())
+    ]
+
+
+def rebuild_item_counts(db: Session) -> int:
+    # 実際のアイテム数から users.item_count を再計算し、修正したユーザー数を返す
+    actual = (
+        select(func.count(models.Item.id)).where(models.Item.owner_id == models.User.id).scalar_subquery()
+    )
+    fixed = db.query(models.User).filter(models.User.item_count != actual).update(
+        {"item_count": actual, "version": models.User.version + 1}, synchronize_session=False
+    )
+    db.commit()
+    return fixed
+
+
 def get_active_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id, models.User.is_active == True).first()
 
 
+def get_active_user_cached(db: Session, user_id: int) -> Optional[schemas.UserSummary]:
+    cached = active_user_cache.get(user_id)
+    if cached is not None:
+        return schemas.UserSummary.construct(**cached)
+
+    generation = active_user_cache.generation()
+    db_user = get_active_user(db, user_id=user_id)
+    if db_user is None:
+        return None
+    # memo: セッションに紐づくORMオブジェクトは共有できないため、スナップショットをキャッシュする。
+    #       ワーカー間で共有するキャッシュでも保存できるよう、JSONに変換できるdictで保存する
+    summary = schemas.UserSummary.from_orm(db_user)
+    active_user_cache.set(user_id, summary.dict(), generation=generation)
+    return summary
+
+
 def get_active_user_with_min_id_excluding(db: Session, exclude_user_id: int):
     return db.query(models.User).filter(models.User.is_active == True, models.User.id != exclude_user_id).order_by(models.User.id.asc()).first()
 
@@ -19,44 +102,288 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(
+    db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, include_items: bool = True
+):
+    # memo: items を遅延ロードするとユーザー毎にSELECTが発行される(N+1)ため、selectinで1クエリにまとめて取得する
+    query = db.query(models.User).options(
+        selectinload(models.User.items) if include_items else noload(models.User.items)
+    )
+    # memo: after_id が指定された場合は id によるキーセットページネーション（offset による読み捨てを避ける）
+    if after_id is not None:
+        return query.filter(models.User.id > after_id).order_by(models.User.id.asc()).limit(limit).all()
+    return query.order_by(models.User.id.asc()).offset(skip).limit(limit).all()
+
+
+def get_users_by_ids(db: Session, user_ids: Sequence[int], include_items: bool = True) -> List[models.User]:
+    # memo: ユーザーは IN (...) の1クエリ、items は selectin で1クエリにまとめて取得する(順序はDBの返した順)
+    user_ids = list(user_ids)
+    users: List[models.User] = []
+    for start in range(0, len(user_ids), ID_LOOKUP_CHUNK_SIZE):
+        chunk = user_ids[start:start + ID_LOOKUP_CHUNK_SIZE]
+        users.extend(
+            db.query(models.User)
+            .options(selectinload(models.User.items) if include_items else noload(models.User.items))
+            .filter(models.User.id.in_(chunk))
+            .all()
+        )
+    return users
+
+
+class UserLoader:
+    # memo: DataLoader と同様に、load() で要求されたIDを溜めておき、最初に結果が必要になった時点で
+    #       溜まっているIDをまとめて get_users_by_ids の1回の問い合わせで取得する。
+    #       取得済みのユーザー(存在しなかったIDも含む)はローダーの生存期間中(1リクエスト)キャッシュする
+    def __init__(self, db: Session, include_items: bool = True) -> None:
+        self.db = db
+        self.include_items = include_items
+        self.dispatches = 0
+        self._pending: List[int] = []
+        self._users: Dict[int, Optional[models.User]] = {}
+
+    def load(self, user_id: int) -> Callable[[], Optional[models.User]]:
+        if user_id not in self._users and user_id not in self._pending:
+            self._pending.append(user_id)
+        return lambda: self._get(user_id)
+
+    def load_many(self, user_ids: Sequence[int]) -> List[Optional[models.User]]:
+        thunks = [self.load(user_id) for user_id in user_ids]
+        return [thunk() for thunk in thunks]
+
+    def dispatch(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._users.update(dict.fromkeys(pending))
+        self._users.update((user.id, user) for user in get_users_by_ids(self.db, pending, self.include_items))
+        self.dispatches += 1
+
+    def _get(self, user_id: int) -> Optional[models.User]:
+        if user_id not in self._users:
+            self.dispatch()
+        return self._users.get(user_id)
 
 
 def create_user(db: Session, user: schemas.UserCreate):
-    fake_hashed_password = user.password + "notreallyhashed"
-    db_user = models.User(email=user.email, hashed_password=fake_hashed_password)
+    hashed_password = hash_password(user.password)
+    db_user = models.User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
 
-def deactivate_user(db: Session, user_id: int, transfer_user_id: int) -> bool:
+# memo: 現状のAPIにはログインルートが無いため、この関数はテストからのみ呼ばれる(将来のログインルート用のフック)。
+#       トークンの発行はユーザー作成時のみで、認証はJWTの検証で行うためパスワードは検証しない
+def authenticate_user(db: Session, email: str, password: str):
+    db_user = get_user_by_email(db, email=email)
+    if db_user is None or not verify_password(password, db_user.hashed_password):
+        return None
+    # memo: ハッシュのコスト設定が変わった場合は、平文パスワードが手元にある検証成功時に再ハッシュして保存し直す
+    if needs_rehash(db_user.hashed_password):
+        db_user.hashed_password = hash_password(password)
+        db.commit()
+        db.refresh(db_user)
+    return db_user
+
+
+def transfer_user_items_chunk(
+    db: Session, user_id: int, transfer_user_id: int, batch_size: int, after_id: int = 0
+) -> List[int]:
+    # memo: id を起点に次のチャンクを取得し、移管済みの行を毎回読み直さないようにする
+    ids = [
+        row.id
+        for row in db.query(models.Item.id)
+        .filter(models.Item.owner_id == user_id, models.Item.id > after_id)
+        .order_by(models.Item.id.asc())
+        .limit(batch_size)
+    ]
+    if ids:
+        db.query(models.Item).filter(models.Item.id.in_(ids), models.Item.owner_id == user_id).update(
+            {"owner_id": transfer_user_id, "version": models.Item.version + 1}, synchronize_session=False
+        )
+        add_user_item_count(db, user_id, -len(ids))
+        add_user_item_count(db, transfer_user_id, len(ids))
+    return ids
+
+
+def deactivate_user(
+    db: Session,
+    user_id: int,
+    transfer_user_id: int,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> bool:
+    if batch_size is None:
+        batch_size = settings.deactivate_batch_size
     try:
         # タスクの所有者を移管
-        # memo: 数が多い場合はバッチ処理にするなど検討が必要だが、今回は演習のため単純化
-        db.query(models.Item).filter(models.Item.owner_id == user_id).update({"owner_id": transfer_user_id})
+        # memo: 件数が多い場合に書き込みロックを長時間保持しないよう、batch_size 件ずつコミットしながら移管する。
+        #       途中で中断してもユーザーはアクティブのまま残るため、再実行すれば残りのアイテムから移管を再開できる
+        transferred = 0
+        if batch_size > 0:
+            last_id = 0
+            while True:
+                ids = transfer_user_items_chunk(db, user_id, transfer_user_id, batch_size, after_id=last_id)
+                db.commit()
+                if not ids:
+                    break
+                transferred += len(ids)
+                last_id = ids[-1]
+                if progress is not None:
+                    progress(transferred)
+                if len(ids) < batch_size:
+                    break
+        # チャンク処理中に追加されたアイテムも含めて、残りの移管とユーザーの非アクティブ化を1トランザクションで行う
+        moved = db.query(models.Item).filter(models.Item.owner_id == user_id).update(
+            {"owner_id": transfer_user_id, "version": models.Item.version + 1}, synchronize_session=False
+        )
+        if moved:
+            add_user_item_count(db, user_id, -moved)
+            add_user_item_count(db, transfer_user_id, moved)
         # ユーザーを非アクティブ化
-        db.query(models.User).filter(models.User.id == user_id).update({"is_active": False})
+        db.query(models.User).filter(models.User.id == user_id).update(
+            {"is_active": False, "version": models.User.version + 1}
+        )
         db.commit()
+        if progress is not None and moved:
+            progress(transferred + moved)
         return True
     except Exception:
         db.rollback()
         return False
+    finally:
+        # コミット後にキャッシュを無効化し、非アクティブ化したユーザーを即座に認証エラーにする
+        active_user_cache.invalidate(user_id)
+
+
+def iter_users_for_export(db: Session, chunk_size: int = EXPORT_CHUNK_SIZE):
+    # memo: 全件をメモリに載せないよう、ORMオブジェクトではなく列だけをサーバーサイドカーソルで少しずつ取得する
+    return (
+        db.query(models.User.id, models.User.email, models.User.is_active)
+        .order_by(models.User.id.asc())
+        .yield_per(chunk_size)
+    )
+
+
+def _items_page(query, skip: int, limit: int, after_id: Optional[int]):
+    if after_id is not None:
+        return query.filter(models.Item.id > after_id).order_by(models.Item.id.asc()).limit(limit).all()
+    return query.order_by(models.Item.id.asc()).offset(skip).limit(limit).all()
+
+
+def get_items(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return _items_page(db.query(models.Item), skip, limit, after_id)
+
+
+def get_item_versions(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    # ETagの確認用に、get_items と同じページの id と version だけを取得する
+    return _items_page(db.query(models.Item.id, models.Item.version), skip, limit, after_id)
+
+
+def get_user_items(db: Session, user_id: int, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return _items_page(db.query(models.Item).filter(models.Item.owner_id == user_id), skip, limit, after_id)
+
 
+def iter_items_for_export(db: Session, chunk_size: int = EXPORT_CHUNK_SIZE):
+    return (
+        db.query(models.Item.id, models.Item.title, models.Item.description, models.Item.owner_id)
+        .order_by(models.Item.id.asc())
+        .yield_per(chunk_size)
+    )
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
 
+def search_items(
+    db: Session, query: str, limit: int = 100, after: Optional[Tuple[float, int]] = None
+) -> List[Tuple[models.Item, float]]:
+    match = build_match_query(query)
+    if not match:
+        return []
 
-def get_user_items(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).filter(models.Item.owner_id == user_id).offset(skip).limit(limit).all()
+    if db.get_bind().dialect.name != "sqlite":
+        # memo: FTS5はSQLite専用のため、それ以外のDBではLIKEによる全件走査で代替する(スコアは全て0)
+        pattern = f"%{escape_like(query)}%"
+        db_query = db.query(models.Item).filter(
+            or_(
+                models.Item.title.like(pattern, escape=LIKE_ESCAPE),
+                models.Item.description.like(pattern, escape=LIKE_ESCAPE),
+            )
+        )
+        if after is not None:
+            db_query = db_query.filter(models.Item.id > after[1])
+        items = db_query.order_by(models.Item.id.asc()).limit(limit).all()
+        return [(item, 0.0) for item in items]
+
+    # スコア(bm25, 小さいほど関連度が高い)の昇順、同じスコアの場合はid順に並べる
+    rank = items_fts.c.rank
+    db_query = (
+        db.query(models.Item, rank)
+        .join(items_fts, items_fts.c.rowid == models.Item.id)
+        .filter(text("items_fts MATCH :match").bindparams(match=match))
+    )
+    if after is not None:
+        after_rank, after_id = after
+        db_query = db_query.filter(or_(rank > after_rank, and_(rank == after_rank, models.Item.id > after_id)))
+    return db_query.order_by(rank.asc(), models.Item.id.asc()).limit(limit).all()
 
 
 def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
     db_item = models.Item(**item.dict(), owner_id=user_id)
     db.add(db_item)
+    add_user_item_count(db, user_id, 1)
     db.commit()
     db.refresh(db_item)
     return db_item
+
+
+def _insert_items(db: Session, rows: List[dict], chunk_size: int = BULK_INSERT_CHUNK_SIZE) -> List[int]:
+    table = models.Item.__table__
+    supports_returning = getattr(db.get_bind().dialect, "full_returning", False)
+    ids: List[int] = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        if supports_returning:
+            result = db.execute(insert(table).values(chunk).returning(table.c.id))
+            ids.extend(row.id for row in result)
+        else:
+            # memo: RETURNINGが使えない場合、SQLiteは1文の複数行INSERTに連番のrowidを振るため最後のrowidから逆算する
+            result = db.execute(insert(table).values(chunk))
+            last_id = result.lastrowid
+            ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+    return ids
+
+
+def create_user_items(
+    db: Session, items: Sequence[schemas.ItemCreate], user_id: int, chunk_size: int = BULK_INSERT_CHUNK_SIZE
+) -> List[int]:
+    try:
+        # 全チャンクを1トランザクションで登録し、途中で失敗した場合は全てロールバックする
+        ids = _insert_items(db, [{**item.dict(), "owner_id": user_id} for item in items], chunk_size)
+        if ids:
+            add_user_item_count(db, user_id, len(ids))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return ids
+
+
+def create_items_batch(
+    db: Session, requests: Sequence[Tuple[int, schemas.ItemCreate]]
+) -> List[Union[schemas.Item, Exception]]:
+    # memo: 複数のリクエストのアイテムを1トランザクション(コミット1回)でまとめて登録し、リクエスト毎の結果を返す
+    try:
+        ids = _insert_items(db, [{**item.dict(), "owner_id": user_id} for user_id, item in requests])
+        for user_id, count in Counter(user_id for user_id, _ in requests).items():
+            add_user_item_count(db, user_id, count)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        if len(requests) == 1:
+            return [exc]
+        # どのリクエストが原因か分からないため、1件ずつ登録し直して失敗したリクエストにだけエラーを返す
+        return [result for request in requests for result in create_items_batch(db, [request])]
+    return [
+        schemas.Item(id=item_id, owner_id=user_id, **item.dict())
+        for item_id, (user_id, item) in zip(ids, requests)
+    ]
@@ -2,24 +2,46 @@
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import APIKeyHeader
 
+from typing import Callable, ContextManager
+
 from sqlalchemy.orm import Session
-from ..database import get_db
+from starlette.authentication import BaseUser
+from ..database import get_write_session_scope
+from ..middlewares.auth_middleware import AuthenticationBackend
 from .. import crud, schemas
 from ..utils.auth import AuthenticatedUser, UnauthenticatedUser
 
 from ..schemas import User
-from .. import models
 
 
 api_key_header = APIKeyHeader(name="X-API-TOKEN", auto_error=True)
 
 
-def verify_active_user(request: Request, db: Session = Depends(get_db), api_key: str = Depends(api_key_header)) -> models.User:
+# memo: 認証ミドルウェアは全リクエストでトークンを検証してしまうため、認証が必要なルートの依存関係としてのみ検証する。
+#       公開ルート(/health-check, POST /users/, /metrics)ではトークンを一切参照しない
+auth_backend = AuthenticationBackend()
+
+
+def authenticate(request: Request, api_key: str = Depends(api_key_header)) -> BaseUser:
+    # ヘッダーから取得済みのトークンを1度だけ検証し、結果を request.user としてルートと共有する
+    credentials, user = auth_backend.authenticate_token(api_key)
+    request.scope["auth"] = credentials
+    request.scope["user"] = user
+    return user
+
+
+# memo: キャッシュが無い場合だけセッションを開き、プライマリから読む。非アクティブ化の直後にレプリカの古い値(アクティブ)を読むと、
+#       無効化したキャッシュにその値が再び保存され、TTLの間は非アクティブなユーザーが認証されてしまうため
+def verify_active_user(
+    user: BaseUser = Depends(authenticate),
+    session_scope: Callable[..., ContextManager[Session]] = Depends(get_write_session_scope),
+) -> schemas.UserSummary:
     # 認証済みか確認
-    if not request.user.is_authenticated:
+    if not user.is_authenticated:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    # アクティブユーザーか確認
-    db_user = crud.get_active_user(db, user_id=request.user.id)
+    # アクティブユーザーか確認(セッションは最初のクエリまで接続しないため、キャッシュにあればDBへ接続しない)
+    with session_scope() as db:
+        db_user = crud.get_active_user_cached(db, user_id=user.id)
     if not db_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     return db_user
@@ -1,26 +1,143 @@
-from typing import List
+from typing import Callable, ContextManager, List, Optional, Tuple, Type
 
-from fastapi import Depends, FastAPI, APIRouter, HTTPException, Request
+from anyio import to_thread
+from fastapi import Depends, FastAPI, APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
-from . import crud, models, schemas
-from .database import SessionLocal, engine, get_db
+from . import crud, database, migrations, models, schemas
+from .config import settings
+from .database import (
+    SessionLocal,
+    check_pool_capacity,
+    engine,
+    get_db,
+    get_read_db,
+    get_write_session_scope,
+    mark_recent_write,
+    request_user_id,
+    write_session_scope,
+)
 
+from .utils.batch_writer import BatchWriter
+from .utils.etag import ETAG_HEADER, etag_matches, make_etag, not_modified
 from .utils.jwt import jwt_claims,jwt_encode
+from .utils.ndjson import NDJSON_MEDIA_TYPE, iter_ndjson
+from .utils.pagination import (
+    NEXT_CURSOR_HEADER,
+    InvalidCursorError,
+    decode_cursor,
+    decode_rank_cursor,
+    encode_rank_cursor,
+    next_cursor,
+)
+from .utils.password import shutdown_executor
+from .utils.metrics import install_query_listeners, registry
+from .utils.serialization import dump_orm
 
-from starlette.middleware.authentication import AuthenticationMiddleware
-from .middlewares import AuthenticationBackend
+from .middlewares import MetricsMiddleware
 
-from .dependencies.auth_dependency import verify_active_user
+from .dependencies.auth_dependency import auth_backend, verify_active_user
 
-models.Base.metadata.create_all(bind=engine)
+default_response_class = ORJSONResponse if settings.orjson_response else JSONResponse
 
-app = FastAPI()
+app = FastAPI(default_response_class=default_response_class)
 
-# memo: 認証済みのユーザーID取得用に認証ミドルウェアを追加
-app.add_middleware(AuthenticationMiddleware, backend=AuthenticationBackend())
+# memo: 認証はルート毎の依存関係(verify_active_user)で行い、公開ルートではトークンを検証しない
+app.add_middleware(MetricsMiddleware)
+install_query_listeners()
 
 db_session = Depends(get_db)
+# memo: 参照系(GET)のルートはレプリカが設定されていればレプリカから読む
+read_db_session = Depends(get_read_db)
+
+
+# memo: import時にDBへ接続しないよう、テーブルの作成とマイグレーションは起動時に行う
+@app.on_event("startup")
+def setup_schema() -> None:
+    if settings.schema_setup:
+        migrations.setup_schema(engine)
+
+
+@app.on_event("startup")
+async def configure_threadpool() -> None:
+    check_pool_capacity()
+    to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_size
+
+
+@app.on_event("shutdown")
+def shutdown_password_executor() -> None:
+    shutdown_executor()
+
+
+# アイテム作成をまとめて書き込むライター(item_write_coalescing が有効な場合のみ起動する)
+item_writer: Optional[BatchWriter] = None
+
+
+def flush_item_creates(batch: List[Tuple[int, schemas.ItemCreate]]) -> list:
+    with write_session_scope() as db:
+        return crud.create_items_batch(db, batch)
+
+
+@app.on_event("startup")
+async def start_item_writer() -> None:
+    global item_writer
+    if settings.item_write_coalescing:
+        item_writer = BatchWriter(
+            flush_item_creates,
+            max_size=settings.item_write_batch_size,
+            max_delay=settings.item_write_batch_ms / 1000,
+        )
+        item_writer.start()
+
+
+@app.on_event("shutdown")
+async def stop_item_writer() -> None:
+    # memo: 受け付け済みのアイテム作成を全て書き込んでから終了する
+    global item_writer
+    writer, item_writer = item_writer, None
+    if writer is not None:
+        await writer.close()
+
+
+# memo: 共有キャッシュ(sqlite)の接続を閉じる。アイテムの書き込みでキャッシュを使うため、ライターの停止後に行う
+@app.on_event("shutdown")
+def close_caches() -> None:
+    crud.active_user_cache.close()
+    if database.session_router.recent_writers is not None:
+        database.session_router.recent_writers.close()
+
+
+def cursor_after_id(cursor: Optional[str] = None) -> Optional[int]:
+    # memo: cursor が指定された場合はキーセットページネーション、未指定の場合は従来の skip/limit で取得する
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def list_response(
+    response: Response,
+    rows: list,
+    schema: Type[BaseModel],
+    cursor: Optional[str],
+    direct: bool = False,
+    etag: Optional[str] = None,
+):
+    # memo: 一覧APIはDBから取得した行をそのまま返すため、設定に応じて response_model による再検証を省略する。
+    #       direct=True の場合は response_model と異なる schema で返すため常に直接レスポンスを作る
+    headers = {NEXT_CURSOR_HEADER: cursor} if cursor is not None else {}
+    if etag is not None:
+        headers[ETAG_HEADER] = etag
+    if settings.skip_response_validation or direct:
+        return default_response_class(content=[dump_orm(row, schema) for row in rows], headers=headers)
+    response.headers.update(headers)
+    return rows
+
 
 public_router = APIRouter()
 authentication_router = APIRouter(dependencies=[Depends(verify_active_user)])
@@ -32,6 +149,23 @@ def health_check(db: Session = db_session):
     return {"status": "ok"}
 
 
+# memo: Prometheusから認証無しでスクレイプするためpublicルーターに追加
+@public_router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    counters = {}
+    for prefix, cache in [("active_user_cache", crud.active_user_cache), ("jwt_claims_cache", auth_backend.claims_cache)]:
+        if cache is None:
+            continue
+        stats = cache.stats()
+        counters.update({
+            f"{prefix}_hits_total": stats["hits"],
+            f"{prefix}_misses_total": stats["misses"],
+            f"{prefix}_evictions_total": stats["evictions"],
+            f"{prefix}_size": stats["size"],
+        })
+    return PlainTextResponse(registry.render(counters), media_type="text/plain; version=0.0.4")
+
+
 @public_router.post("/users/", response_model=schemas.UserCreateResponse)
 def create_user(user: schemas.UserCreate, db: Session = db_session):
     db_user = crud.get_user_by_email(db, email=user.email)
@@ -39,6 +173,8 @@ def create_user(user: schemas.UserCreate, db: Session = db_session):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user = crud.create_user(db=db, user=user)
+    # 作成直後のユーザーがレプリカの遅延で見つからないよう、作成したユーザーも一定時間プライマリから読む
+    mark_recent_write(user.id)
     claim_set = jwt_claims(user)
     return schemas.UserCreateResponse(
         user=user,
@@ -47,19 +183,83 @@ def create_user(user: schemas.UserCreate, db: Session = db_session):
 
 
 @authentication_router.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = db_session):
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = Depends(cursor_after_id),
+    include_items: bool = True,
+    db: Session = read_db_session,
+):
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=after_id, include_items=include_items)
+    if not include_items:
+        # memo: items を含めない場合は response_model (items付き) を通さず、itemsフィールド自体を返さない
+        return list_response(response, users, schemas.UserSummary, next_cursor(users, limit), direct=True)
+    return list_response(response, users, schemas.User, next_cursor(users, limit))
+
+
+def get_user_loader(db: Session = read_db_session) -> crud.UserLoader:
+    # memo: 依存関係はリクエスト内でキャッシュされるため、同じリクエスト内のユーザー取得は1つのローダーにまとまる
+    return crud.UserLoader(db)
+
+
+# memo: 一覧画面などで owner_id 毎に /users/{user_id} を呼ぶ代わりに、複数のユーザーをまとめて取得する。
+#       末尾スラッシュ付きの /users/batch/ はリダイレクトされる(スラッシュ無しでも /users/{user_id} に一致しない)
+# 重複を含めた ids の数の上限(user_batch_max_ids の倍数)。重複をまとめる前に、大量のIDを送るリクエストを拒否する
+USER_BATCH_RAW_IDS_FACTOR = 2
+
+
+@authentication_router.get("/users/batch", response_model=List[schemas.User])
+def read_users_batch(
+    response: Response, ids: List[int] = Query(...), loader: crud.UserLoader = Depends(get_user_loader)
+):
+    if len(ids) > settings.user_batch_max_ids * USER_BATCH_RAW_IDS_FACTOR:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {settings.user_batch_max_ids})")
+    # 重複したIDは1件にまとめ、上限はまとめた後のIDの数で判定する
+    unique_ids = list(dict.fromkeys(ids))
+    if len(unique_ids) > settings.user_batch_max_ids:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {settings.user_batch_max_ids})")
+    # 指定された順に返す(存在しないIDは含めない)
+    users = [user for user in loader.load_many(unique_ids) if user is not None]
+    return list_response(response, users, schemas.User, None)
+
+
+def user_etag(user_id: int, version: int) -> str:
+    return make_etag("user", user_id, version)
+
+
+def items_etag(rows) -> str:
+    return make_etag("items", *(f"{row.id}:{row.version}" for row in rows))
 
 
 @authentication_router.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = db_session):
+def read_user(
+    user_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: Session = read_db_session
+):
+    # memo: If-None-Match がある場合は、ユーザーとアイテムを読み込む前にバージョンだけで変更の有無を確認する
+    if if_none_match is not None:
+        version = crud.get_user_version(db, user_id=user_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        etag = user_etag(user_id, version)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    response.headers[ETAG_HEADER] = user_etag(db_user.id, db_user.version)
     return db_user
 
 
+@authentication_router.get("/users/{user_id}/stats", response_model=schemas.UserStats)
+def read_user_stats(user_id: int, db: Session = read_db_session):
+    stats = crud.get_user_stats(db, user_id=user_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return stats
+
+
 @authentication_router.delete("/users/{user_id}", response_model=schemas.UserDeactivateResponse)
 def deactivate_user(user_id: int, db: Session = db_session):
     db_user = crud.get_active_user(db, user_id=user_id)
@@ -77,22 +277,97 @@ def deactivate_user(user_id: int, db: Session = db_session):
 
 
 @authentication_router.post("/users/{user_id}/items/", response_model=schemas.Item)
-def create_item_for_user(
-    user_id: int, item: schemas.ItemCreate, db: Session = db_session
+async def create_item_for_user(
+    request: Request,
+    user_id: int,
+    item: schemas.ItemCreate,
+    session_scope: Callable[..., ContextManager[Session]] = Depends(get_write_session_scope),
+):
+    # memo: まとめて書き込む場合も、レスポンスは自分のアイテムがコミットされてから返す。
+    #       キューに入れた後にクライアントが切断しても、アイテムはまとめて書き込まれる(レスポンスが返らないだけ)
+    if item_writer is not None:
+        created = await item_writer.submit((user_id, item))
+        mark_recent_write(request_user_id(request))
+        return created
+
+    # まとめて書き込まない場合だけ、リクエストのDBセッションを開く
+    def create_item() -> models.Item:
+        with session_scope(request_user_id(request)) as db:
+            return crud.create_user_item(db=db, item=item, user_id=user_id)
+
+    return await run_in_threadpool(create_item)
+
+
+@authentication_router.post("/users/{user_id}/items/bulk/", response_model=schemas.ItemBulkCreateResponse)
+def create_items_for_user(
+    user_id: int, items: List[schemas.ItemCreate], db: Session = db_session
 ):
-    return crud.create_user_item(db=db, item=item, user_id=user_id)
+    if len(items) > settings.bulk_items_max:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {settings.bulk_items_max})")
+    ids = crud.create_user_items(db=db, items=items, user_id=user_id)
+    return schemas.ItemBulkCreateResponse(ids=ids)
 
 
 @authentication_router.get("/items/", response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = db_session):
-    items = crud.get_items(db, skip=skip, limit=limit)
-    return items
+def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = Depends(cursor_after_id),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = read_db_session,
+):
+    # ページの id と version だけでETagを確認し、変更が無ければ本体を組み立てずに304を返す
+    if if_none_match is not None:
+        versions = crud.get_item_versions(db, skip=skip, limit=limit, after_id=after_id)
+        etag = items_etag(versions)
+        if etag_matches(if_none_match, etag):
+            cursor = next_cursor(versions, limit)
+            return not_modified(etag, {NEXT_CURSOR_HEADER: cursor} if cursor is not None else None)
+
+    items = crud.get_items(db, skip=skip, limit=limit, after_id=after_id)
+    return list_response(response, items, schemas.Item, next_cursor(items, limit), etag=items_etag(items))
+
+
+@authentication_router.get("/items/search/", response_model=List[schemas.Item])
+def search_items(
+    response: Response, q: str, limit: int = 100, cursor: Optional[str] = None, db: Session = read_db_session
+):
+    try:
+        after = decode_rank_cursor(cursor) if cursor is not None else None
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    results = crud.search_items(db, query=q, limit=limit, after=after)
+    cursor = None
+    if limit > 0 and len(results) == limit:
+        last_item, last_rank = results[-1]
+        cursor = encode_rank_cursor(last_rank, last_item.id)
+    return list_response(response, [item for item, _ in results], schemas.Item, cursor)
 
 
 @authentication_router.get("/me/items/", response_model=List[schemas.Item])
-def read_items_for_authenticated_user(request: Request, skip: int = 0, limit: int = 100, db: Session = db_session):
-    items = crud.get_user_items(db, user_id=request.user.id, skip=skip, limit=limit)
-    return items
+def read_items_for_authenticated_user(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = Depends(cursor_after_id),
+    db: Session = read_db_session,
+):
+    items = crud.get_user_items(db, user_id=request.user.id, skip=skip, limit=limit, after_id=after_id)
+    return list_response(response, items, schemas.Item, next_cursor(items, limit))
+
+
+# memo: エクスポートはDBセッションを使いながらレスポンスを書き出す。yield依存関係の終了処理はレスポンス送信後に行われる
+@authentication_router.get("/export/users/", response_class=StreamingResponse)
+def export_users(db: Session = read_db_session):
+    return StreamingResponse(iter_ndjson(crud.iter_users_for_export(db)), media_type=NDJSON_MEDIA_TYPE)
+
+
+@authentication_router.get("/export/items/", response_class=StreamingResponse)
+def export_items(db: Session = read_db_session):
+    return StreamingResponse(iter_ndjson(crud.iter_items_for_export(db)), media_type=NDJSON_MEDIA_TYPE)
 
 
 app.include_router(public_router)
@@ -1 +1,18 @@
-from .auth_middleware import *
+import importlib
+from typing import Any
+
+# memo: utils と同様に、ミドルウェアは初回アクセス時に該当するモジュールを読み込む
+_LAZY_ATTRIBUTES = {
+    "AuthenticationBackend": ".auth_middleware",
+    "MetricsMiddleware": ".metrics_middleware",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -1,25 +1,50 @@
-from typing import Optional, Tuple
+import time
+from typing import Any, Dict, Optional, Tuple
 
 from fastapi import Request
 from fastapi.security.utils import get_authorization_scheme_param
 
-from jose.jwt import ExpiredSignatureError, JWTError
+from jose.exceptions import ExpiredSignatureError, JWTError
 
 from starlette.authentication import AuthCredentials, BaseUser
 from starlette.middleware import authentication
 
 from ..utils import AuthenticatedUser, UnauthenticatedUser, jwt_decode
+from ..utils.cache import TTLCache
+
+# memo: 同じトークンが繰り返し使われるため、検証済みのクレームをトークン毎にキャッシュして署名検証を省略する
+CLAIMS_CACHE_SIZE = 4096
+CLAIMS_CACHE_TTL = 300.0
 
 
 class AuthenticationBackend(authentication.AuthenticationBackend):
-    async def authenticate(self, request: Request) -> Optional[Tuple[AuthCredentials, BaseUser]]:
-        # X-API-TOKENヘッダーからトークンを取得
-        auth_header = request.headers.get("X-API-TOKEN")
-        if not auth_header:
+    def __init__(self, cache_size: int = CLAIMS_CACHE_SIZE, cache_ttl: float = CLAIMS_CACHE_TTL) -> None:
+        # cache_size に0を指定した場合はキャッシュを無効化し、毎回トークンを検証する
+        self.claims_cache: Optional[TTLCache] = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_size > 0 else None
+
+    def decode_claims(self, token: str) -> Dict[str, Any]:
+        if self.claims_cache is None:
+            return jwt_decode(token)
+
+        payload = self.claims_cache.get(token)
+        if payload is not None:
+            return payload
+
+        payload = jwt_decode(token)
+        ttl: Optional[float] = None
+        # exp クレームがある場合は、有効期限を過ぎたトークンがキャッシュから返らないよう期限までに制限する
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            ttl = exp - time.time()
+        self.claims_cache.set(token, payload, ttl=ttl)
+        return payload
+
+    def authenticate_token(self, token: Optional[str]) -> Tuple[AuthCredentials, BaseUser]:
+        if not token:
             return (AuthCredentials(["unauthenticated"]), UnauthenticatedUser())
 
         try:
-            payload = jwt_decode(auth_header)
+            payload = self.decode_claims(token)
         except ExpiredSignatureError:
             return (AuthCredentials(["unauthenticated"]), UnauthenticatedUser())
         except JWTError:
@@ -32,3 +57,7 @@ class AuthenticationBackend(authentication.AuthenticationBackend):
             return (AuthCredentials(["unauthenticated"]), UnauthenticatedUser())
 
         return (AuthCredentials(["authenticated"]), AuthenticatedUser(user_id=user_id))
+
+    async def authenticate(self, request: Request) -> Optional[Tuple[AuthCredentials, BaseUser]]:
+        # X-API-TOKENヘッダーからトークンを取得
+        return self.authenticate_token(request.headers.get("X-API-TOKEN"))
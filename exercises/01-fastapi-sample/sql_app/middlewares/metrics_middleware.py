@@ -0,0 +1,37 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..utils.metrics import RequestStats, current_request_stats, registry
+
+
+class MetricsMiddleware:
+    # memo: リクエスト全体(認証・ハンドラ・シリアライズ)のレイテンシと、その間に発行されたクエリ数・時間をルート毎に記録する
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request_stats.reset(token)
+            # パスパラメータ毎に系列が増えないよう、ルーティング後のパステンプレートをラベルにする
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            registry.observe_request(scope["method"], route_path, status, elapsed, stats)
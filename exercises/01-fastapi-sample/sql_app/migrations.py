@@ -0,0 +1,121 @@
+from typing import List, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import crud, models
+
+# memo: 以前のスキーマで作成されていた不要なインデックス(主キーの重複インデックス・等価検索されない列のインデックス)
+OBSOLETE_INDEXES = {
+    "users": ["ix_users_id"],
+    "items": ["ix_items_id", "ix_items_title", "ix_items_description"],
+}
+
+
+def migrate_indexes(engine: Engine) -> List[str]:
+    # 既存のDBに対して不要なインデックスを削除し、モデルに定義されたインデックスを作成する
+    applied = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for name in OBSOLETE_INDEXES.get(table.name, []):
+                if name in existing:
+                    conn.exec_driver_sql(f"DROP INDEX {name}")
+                    applied.append(f"drop {name}")
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=conn)
+                    applied.append(f"create {index.name}")
+    return applied
+
+
+def migrate_item_search(engine: Engine) -> List[str]:
+    # 全文検索用のテーブルが無い既存のSQLiteのDBに対して、テーブルとトリガーを作成し既存のアイテムから索引を構築する
+    inspector = inspect(engine)
+    if engine.dialect.name != "sqlite" or not inspector.has_table("items") or inspector.has_table("items_fts"):
+        return []
+    with engine.begin() as conn:
+        for ddl in models.ITEMS_FTS_DDL:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("INSERT INTO items_fts(items_fts) VALUES ('rebuild')")
+    return ["create items_fts"]
+
+
+# 既存のDBに後から追加した列(テーブル名, 列名, 列定義)
+ADDED_COLUMNS = [
+    ("users", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("items", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("users", "item_count", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+def migrate_columns(engine: Engine) -> List[str]:
+    # モデルに追加した列が無い既存のDBに対して、列を追加する
+    applied = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, column_name, definition in ADDED_COLUMNS:
+            if not inspector.has_table(table_name):
+                continue
+            if column_name in {column["name"] for column in inspector.get_columns(table_name)}:
+                continue
+            conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}")
+            applied.append(f"add {table_name}.{column_name}")
+    return applied
+
+
+def migrate_item_counts(engine: Engine, added_columns: List[str]) -> List[str]:
+    # item_count 列を追加した場合は、既存のアイテムから件数を集計する
+    if "add users.item_count" not in added_columns:
+        return []
+    db = Session(bind=engine)
+    try:
+        crud.rebuild_item_counts(db)
+    finally:
+        db.close()
+    return ["rebuild users.item_count"]
+
+
+def migrate(engine: Engine) -> List[str]:
+    added_columns = migrate_columns(engine)
+    return (
+        added_columns
+        + migrate_indexes(engine)
+        + migrate_item_search(engine)
+        + migrate_item_counts(engine, added_columns)
+    )
+
+
+# memo: スキーマ(テーブル・列・インデックス)を変更した場合はこの値を増やす。
+#       SQLiteでは PRAGMA user_version に保存し、一致する場合は起動時のスキーマの確認を省略する
+SCHEMA_VERSION = 1
+
+
+def schema_version(engine: Engine) -> Optional[int]:
+    if engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def setup_schema(engine: Engine) -> List[str]:
+    # テーブルの作成とマイグレーションを行う。スキーマが最新の場合は何もしない
+    if schema_version(engine) == SCHEMA_VERSION:
+        return []
+    models.Base.metadata.create_all(bind=engine)
+    applied = migrate(engine)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return applied
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    for step in setup_schema(engine) or ["nothing to migrate"]:
+        print(step)
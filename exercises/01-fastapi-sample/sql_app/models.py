@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from sqlalchemy import DDL, Boolean, Column, ForeignKey, Index, Integer, String, event
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -6,21 +6,52 @@ from .database import Base
 
 class User(Base):
     __tablename__ = "users"
+    # memo: アクティブユーザーの中から最小IDを探すクエリ用
+    __table_args__ = (Index("ix_users_is_active_id", "is_active", "id"),)
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
+    # memo: ETag用の行バージョン。ユーザー自身の更新に加え、所有するアイテムの追加・移管でも加算する
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # memo: 所有するアイテム数。アイテムを数えずに取得できるよう、アイテムの追加・移管と同じトランザクションで更新する
+    item_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     items = relationship("Item", back_populates="owner")
 
 
 class Item(Base):
     __tablename__ = "items"
+    # memo: ユーザー毎のアイテム取得・所有権の移管で owner_id で絞り込み id 順に取得するため
+    __table_args__ = (Index("ix_items_owner_id_id", "owner_id", "id"),)
 
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    description = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # ETag用の行バージョン。アイテムを更新する度に加算する
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     owner = relationship("User", back_populates="items")
+
+
+# memo: items の title/description を全文検索するためのFTS5仮想テーブル(外部コンテンツ)。
+#       一括登録や所有権の移管など、どの経路で書き込まれても同期されるようトリガーで items と同期する
+ITEMS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(title, description, content='items', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF title, description ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+for ddl in ITEMS_FTS_DDL:
+    event.listen(Item.__table__, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+event.listen(Item.__table__, "before_drop", DDL("DROP TABLE IF EXISTS items_fts").execute_if(dialect="sqlite"))
@@ -20,6 +20,10 @@ class Item(ItemBase):
         orm_mode = True
 
 
+class ItemBulkCreateResponse(BaseModel):
+    ids: List[int]
+
+
 class UserBase(BaseModel):
     email: str
 
@@ -28,11 +32,23 @@ class UserCreate(UserBase):
     password: str
 
 
-class User(UserBase):
+class UserSummary(UserBase):
     id: int
     is_active: bool
+
+    class Config:
+        orm_mode = True
+
+
+class User(UserSummary):
+    item_count: int = 0
     items: List[Item] = []
 
+
+class UserStats(BaseModel):
+    id: int
+    item_count: int
+
     class Config:
         orm_mode = True
 
@@ -1,32 +1,91 @@
+import os
+from contextlib import contextmanager
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from ..database import Base
-from ..main import app, get_db
+from ..config import settings
+from ..database import Base, SessionRouter, create_db_engine
+from ..main import app, get_db, get_read_db, get_write_session_scope
 
 from ..dependencies.auth_dependency import verify_active_user
 
-from .. import schemas
+from .. import crud, schemas
+from ..utils.metrics import registry
+from .helpers import FakeTimer
+
+# memo: 既定ではインメモリのSQLiteを使う。SQL_APP_TEST_DATABASE=file の場合はワーカー毎のファイルを使う(pytest-xdist対応)
+TEST_DATABASE = os.environ.get("SQL_APP_TEST_DATABASE", "memory")
+WORKER_ID = os.environ.get("PYTEST_XDIST_WORKER", "master")
+TEST_DATABASE_FILE = f"./test_{WORKER_ID}.db"
+
+if TEST_DATABASE == "file":
+    SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DATABASE_FILE}"
+else:
+    SQLALCHEMY_DATABASE_URL = "sqlite://"
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+# memo: テストではユーザー作成が多いため、パスワードハッシュのコストを下げてプロセスプールも使わない
+settings.password_scrypt_n = 2 ** 4
+settings.password_hash_workers = 0
 
+# テスト中は全てのセッションが1つの接続を共有し、テスト毎のトランザクションの中で動く
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+# memo: pysqlite はSAVEPOINTを正しく扱えないため、トランザクションの開始をSQLAlchemy側で行う
+@event.listens_for(engine, "connect")
+def disable_pysqlite_transaction(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(engine, "begin")
+def emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+test_connection = None
+
+
+def TestingSessionLocal(connection) -> Session:
+    # memo: SQLAlchemy の "Joining a Session into an External Transaction" の方法で、テスト用トランザクションの接続に参加する。
+    #       各セッションは接続のSAVEPOINTに参加し、commit で解放(確定)、rollback で巻き戻した後にSAVEPOINTを開始し直す。
+    #       identity map はセッション毎に分かれるため、APIとテストコードは別々のセッションで読み書きする
+    session = Session(bind=connection, autocommit=False, autoflush=False)
+
+    @event.listens_for(session, "after_transaction_end")
+    def restart_savepoint(session, transaction):
+        if transaction.parent is None and not connection.in_nested_transaction():
+            connection.begin_nested()
+
+    return session
 
 
 def override_get_db():
+    # リクエスト毎に、テスト用トランザクションの接続に参加する別のセッションを使う
+    db = TestingSessionLocal(test_connection)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def override_write_session_scope(key=None):
+    db = TestingSessionLocal(test_connection)
     try:
-        db = TestingSessionLocal()
         yield db
     finally:
         db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_write_session_scope] = lambda: override_write_session_scope
 
 
 def override_verify_active_user():
@@ -39,16 +98,60 @@ def override_verify_active_user():
     return mock_user
 
 
-@pytest.fixture()
-def test_db():
+@pytest.fixture(scope="session", autouse=True)
+def test_schema():
+    # スキーマはテストセッションで1度だけ作成する
     Base.metadata.create_all(bind=engine)
-    # テストに、dbセッションが必要なため追加
-    db = TestingSessionLocal()
+    yield
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    if TEST_DATABASE == "file" and os.path.exists(TEST_DATABASE_FILE):
+        os.remove(TEST_DATABASE_FILE)
+
+
+@pytest.fixture(autouse=True)
+def test_transaction(test_schema):
+    # テスト毎にトランザクションを開始し、終了時にロールバックしてデータを元に戻す
+    global test_connection
+    connection = engine.connect()
+    transaction = connection.begin()
+    connection.begin_nested()
+    test_connection = connection
+    session = TestingSessionLocal(connection)
     try:
-        yield db
+        yield session
     finally:
-        db.close()
-        Base.metadata.drop_all(bind=engine)
+        session.close()
+        test_connection = None
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture()
+def test_session_factory(test_transaction):
+    # APIの外で書き込む処理(バッチ書き込みなど)に、テスト用の接続に参加する別のセッションを渡す用
+    return lambda: TestingSessionLocal(test_connection)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # テスト毎にデータを元に戻すため、プロセス内のキャッシュもクリアする
+    crud.active_user_cache.clear()
+    registry.reset()
+    yield
+    crud.active_user_cache.clear()
+
+
+@pytest.fixture()
+def test_db(test_transaction):
+    # テストに、dbセッションが必要なため追加
+    return test_transaction
+
+
+@pytest.fixture()
+def test_engine():
+    # クエリ数の計測など、エンジンに対してイベントを登録するテスト用
+    return engine
 
 
 @pytest.fixture()
@@ -56,3 +159,21 @@ def client():
     app.dependency_overrides[verify_active_user] = override_verify_active_user
     client = TestClient(app)
     return client
+
+
+@pytest.fixture()
+def replica_router(tmp_path):
+    # プライマリとレプリカの代わりに2つのSQLiteファイルを使うセッションルーター
+    timer = FakeTimer()
+    engines = [create_db_engine(f"sqlite:///{tmp_path / name}") for name in ("primary.db", "replica.db")]
+    for db_engine in engines:
+        Base.metadata.create_all(bind=db_engine)
+    router = SessionRouter(
+        sessionmaker(autocommit=False, autoflush=False, bind=engines[0]),
+        sessionmaker(autocommit=False, autoflush=False, bind=engines[1]),
+        read_your_writes_seconds=5.0,
+        timer=timer,
+    )
+    yield router, timer
+    for db_engine in engines:
+        db_engine.dispose()
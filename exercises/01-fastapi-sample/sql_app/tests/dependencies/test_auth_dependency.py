@@ -1,11 +1,18 @@
+from contextlib import nullcontext
+
 import pytest
 
-from unittest.mock import Mock
-from fastapi import HTTPException, Request
+from fastapi import HTTPException
 
 from ...dependencies.auth_dependency import verify_active_user
 from ...utils.auth import AuthenticatedUser, UnauthenticatedUser
 from ... import crud
+from ...utils.query_counter import count_queries
+
+
+def session_scope(db):
+    # テスト用のセッションをそのまま使うセッションスコープ
+    return lambda key=None: nullcontext(db)
 
 
 # 有効な認証情報がある場合のテスト
@@ -17,10 +24,9 @@ def test_verify_active_user_success(test_db):
     )
     test_db.commit()
 
-    mock_request = Mock(spec=Request)
-    mock_request.user = AuthenticatedUser(user_id=user_id)
+    auth_user = AuthenticatedUser(user_id=user_id)
 
-    user = verify_active_user(mock_request, test_db, "X-API-TOKEN")
+    user = verify_active_user(auth_user, session_scope(test_db))
 
     assert user.id == user_id
     assert user.is_active is True
@@ -28,11 +34,10 @@ def test_verify_active_user_success(test_db):
 
 # 認証されていない場合のテスト
 def test_verify_active_user_not_authenticated(test_db):
-    mock_request = Mock(spec=Request)
-    mock_request.user = UnauthenticatedUser()
+    auth_user = UnauthenticatedUser()
 
     with pytest.raises(HTTPException) as exc_info:
-        verify_active_user(mock_request, test_db, "X-API-TOKEN")
+        verify_active_user(auth_user, session_scope(test_db))
 
     assert exc_info.value.status_code == 401
 
@@ -46,12 +51,11 @@ def test_verify_active_user_inactive_user(test_db, client):
     )
     test_db.commit()
 
-    # 認証済みだが非アクティブなユーザーのRequestオブジェクトをモック
-    mock_request = Mock(spec=Request)
-    mock_request.user = AuthenticatedUser(user_id=user_id)
+    # 認証済みだが非アクティブなユーザー
+    auth_user = AuthenticatedUser(user_id=user_id)
 
     with pytest.raises(HTTPException) as exc_info:
-        verify_active_user(mock_request, test_db, "dummy_api_key")
+        verify_active_user(auth_user, session_scope(test_db))
 
     assert exc_info.value.status_code == 401
     assert exc_info.value.detail == "Not authenticated"
@@ -60,11 +64,49 @@ def test_verify_active_user_inactive_user(test_db, client):
 # 存在しないユーザーの場合のテスト
 def test_verify_active_user_nonexistent_user(test_db):
     user_id = 99999
-    mock_request = Mock(spec=Request)
-    mock_request.user = AuthenticatedUser(user_id=user_id)
+    auth_user = AuthenticatedUser(user_id=user_id)
 
     with pytest.raises(HTTPException) as exc_info:
-        verify_active_user(mock_request, test_db, "dummy_api_key")
+        verify_active_user(auth_user, session_scope(test_db))
 
     assert exc_info.value.status_code == 401
     assert exc_info.value.detail == "Not authenticated"
+
+
+# 2回目以降の確認はキャッシュから返り、DBへ問い合わせないことのテスト
+def test_verify_active_user_cached(test_db, test_engine):
+    user_id = 1
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        f"({user_id}, 'test@example.com', 'hashed_testpassword', True)"
+    )
+    test_db.commit()
+
+    auth_user = AuthenticatedUser(user_id=user_id)
+
+    verify_active_user(auth_user, session_scope(test_db))
+    with count_queries(test_engine) as counter:
+        user = verify_active_user(auth_user, session_scope(test_db))
+    assert user.id == user_id
+    assert counter.count == 0
+    assert crud.active_user_cache.stats()["hits"] == 1
+
+
+# 非アクティブ化したユーザーはキャッシュが残っていても即座に認証エラーになることのテスト
+def test_verify_active_user_rejected_right_after_deactivation(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test1@example.com', 'hashed_testpassword', True),"
+        "(2, 'test2@example.com', 'hashed_testpassword', True)"
+    )
+    test_db.commit()
+
+    auth_user = AuthenticatedUser(user_id=2)
+    verify_active_user(auth_user, session_scope(test_db))
+    assert len(crud.active_user_cache) == 1
+
+    assert crud.deactivate_user(test_db, user_id=2, transfer_user_id=1) is True
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_active_user(auth_user, session_scope(test_db))
+    assert exc_info.value.status_code == 401
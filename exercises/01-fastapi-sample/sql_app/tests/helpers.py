@@ -0,0 +1,10 @@
+# テストで共通して使う補助クラス
+
+
+class FakeTimer:
+    # 有効期限のテスト用に、now を書き換えて時刻を進められるタイマー
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
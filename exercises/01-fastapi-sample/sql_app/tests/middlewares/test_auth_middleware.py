@@ -0,0 +1,64 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+from starlette.requests import Request
+
+from ...middlewares import auth_middleware
+from ...middlewares.auth_middleware import AuthenticationBackend
+from ...utils.cache import TTLCache
+from ...utils.jwt import jwt_decode, jwt_encode
+from ..helpers import FakeTimer
+
+
+def make_request(token: str) -> Request:
+    return Request({"type": "http", "headers": [(b"x-api-token", token.encode())]})
+
+
+# 同じトークンの2回目以降はデコードを省略することのテスト
+def test_authenticate_caches_claims():
+    backend = AuthenticationBackend()
+    token = jwt_encode({"user_id": 1})
+
+    with patch.object(auth_middleware, "jwt_decode", wraps=jwt_decode) as decode:
+        for _ in range(3):
+            credentials, user = asyncio.run(backend.authenticate(make_request(token)))
+            assert credentials.scopes == ["authenticated"]
+            assert user.id == 1
+    assert decode.call_count == 1
+    assert backend.claims_cache.stats()["hits"] == 2
+
+
+# キャッシュを無効化した場合は毎回デコードすることのテスト
+def test_authenticate_without_cache():
+    backend = AuthenticationBackend(cache_size=0)
+    token = jwt_encode({"user_id": 1})
+
+    with patch.object(auth_middleware, "jwt_decode", wraps=jwt_decode) as decode:
+        for _ in range(3):
+            asyncio.run(backend.authenticate(make_request(token)))
+    assert decode.call_count == 3
+
+
+# 無効なトークン・期限切れのトークンはキャッシュされず、認証されないことのテスト
+def test_authenticate_invalid_and_expired_tokens_are_not_cached():
+    backend = AuthenticationBackend()
+    expired_token = jwt_encode({"user_id": 1, "exp": int(time.time()) - 10})
+
+    for token in ["invalid_token", expired_token]:
+        credentials, _ = asyncio.run(backend.authenticate(make_request(token)))
+        assert credentials.scopes == ["unauthenticated"]
+    assert len(backend.claims_cache) == 0
+
+
+# exp 付きのトークンは有効期限までしかキャッシュされないことのテスト
+def test_authenticate_cache_respects_exp():
+    timer = FakeTimer()
+    backend = AuthenticationBackend()
+    backend.claims_cache = TTLCache(maxsize=10, ttl=300, timer=timer)
+    token = jwt_encode({"user_id": 1, "exp": int(time.time()) + 60})
+
+    asyncio.run(backend.authenticate(make_request(token)))
+    assert backend.claims_cache.get(token) is not None
+    timer.now = 61
+    assert backend.claims_cache.get(token) is None
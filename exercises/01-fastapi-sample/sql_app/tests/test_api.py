@@ -1,8 +1,20 @@
 # memo: 全体的にfactory botを使ってテストデータを生成したいが、今回は演習のため直接SQLを実行してテストデータを作成する
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import pytest
+from anyio import to_thread
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
 
+from .. import crud, database, main
+from ..config import Settings, settings
+from ..database import get_db, get_read_db, get_write_session_scope
 from ..dependencies.auth_dependency import verify_active_user
 from ..main import app
+from ..utils.pagination import encode_cursor
+from ..utils.query_counter import count_queries
 
 
 def test_create_user(test_db, client):
@@ -30,10 +42,16 @@ def test_auth_endpoints_missing_token(test_db, client):
     endpoints = [
         {"method": "get", "path": "/users/"},
         {"method": "get", "path": "/users/1"},
+        {"method": "get", "path": "/users/1/stats"},
+        {"method": "get", "path": "/users/batch?ids=1"},
         {"method": "delete", "path": "/users/1"},
         {"method": "post", "path": "/users/1/items/", "json": {"title": "test", "description": "test"}},
+        {"method": "post", "path": "/users/1/items/bulk/", "json": [{"title": "test", "description": "test"}]},
         {"method": "get", "path": "/items/"},
-        {"method": "get", "path": "/me/items/"}
+        {"method": "get", "path": "/me/items/"},
+        {"method": "get", "path": "/export/users/"},
+        {"method": "get", "path": "/export/items/"},
+        {"method": "get", "path": "/items/search/?q=test"},
     ]
 
     # 各エンドポイントの認証テスト
@@ -58,10 +76,16 @@ def test_auth_endpoints_without_token(test_db, client):
     endpoints = [
         {"method": "get", "path": "/users/"},
         {"method": "get", "path": "/users/1"},
+        {"method": "get", "path": "/users/1/stats"},
+        {"method": "get", "path": "/users/batch?ids=1"},
         {"method": "delete", "path": "/users/1"},
         {"method": "post", "path": "/users/1/items/", "json": {"title": "test", "description": "test"}},
+        {"method": "post", "path": "/users/1/items/bulk/", "json": [{"title": "test", "description": "test"}]},
         {"method": "get", "path": "/items/"},
-        {"method": "get", "path": "/me/items/"}
+        {"method": "get", "path": "/me/items/"},
+        {"method": "get", "path": "/export/users/"},
+        {"method": "get", "path": "/export/items/"},
+        {"method": "get", "path": "/items/search/?q=test"},
     ]
 
 
@@ -87,10 +111,16 @@ def test_auth_endpoints_with_valid_token(test_db, client):
     endpoints = [
         {"method": "get", "path": "/users/"},
         {"method": "get", "path": "/users/1"},
+        {"method": "get", "path": "/users/1/stats"},
+        {"method": "get", "path": "/users/batch?ids=1"},
         {"method": "delete", "path": "/users/1"},
         {"method": "post", "path": "/users/1/items/", "json": {"title": "test", "description": "test"}},
+        {"method": "post", "path": "/users/1/items/bulk/", "json": [{"title": "test", "description": "test"}]},
         {"method": "get", "path": "/items/"},
-        {"method": "get", "path": "/me/items/"}
+        {"method": "get", "path": "/me/items/"},
+        {"method": "get", "path": "/export/users/"},
+        {"method": "get", "path": "/export/items/"},
+        {"method": "get", "path": "/items/search/?q=test"},
     ]
 
     # 最低一人は、アクティブユーザーがいる想定なので事前に用意
@@ -276,6 +306,24 @@ def test_deactivate_user_success(test_db, client):
     assert len(transfer_user["items"]) == 4
 
 
+# APIはテストコードとは別のセッションで動き、テスト側で読み込み済みのオブジェクトは期限切れにするまで更新されないことのテスト
+def test_api_uses_separate_session(test_db, client):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test1@example.com', 'hashed_password', True),"
+        "(2, 'test2@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+    user = crud.get_user(test_db, user_id=2)
+    assert user.is_active is True
+
+    response = client.delete("/users/2")
+    assert response.status_code == 200, response.text
+    assert user.is_active is True
+    test_db.expire_all()
+    assert user.is_active is False
+
+
 # ユーザー非アクティブAPIでユーザーが存在しない場合のテスト
 def test_deactivate_user_not_found(test_db, client):
     response = client.delete("/users/999")
@@ -311,3 +359,498 @@ def test_deactivate_only_active_user(test_db, client):
     assert response.status_code == 400
     data = response.json()
     assert data["detail"] == "Cannot deactivate the only active user"
+
+
+# カーソルによるページネーションのテスト
+def test_read_items_with_cursor(test_db, client):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1),"
+        "(2, 'Item 2', 'Description 2', 1),"
+        "(3, 'Item 3', 'Description 3', 1)"
+    )
+    test_db.commit()
+
+    # 1ページ目は従来通りのskip/limitで取得し、次のカーソルがヘッダーで返ることを確認
+    response = client.get("/items/?limit=2")
+    assert response.status_code == 200, response.text
+    assert [item["id"] for item in response.json()] == [1, 2]
+    cursor = response.headers["X-Next-Cursor"]
+
+    # カーソルを指定して続きを取得し、最終ページでは次のカーソルが無いことを確認
+    response = client.get(f"/items/?limit=2&cursor={cursor}")
+    assert response.status_code == 200, response.text
+    assert [item["id"] for item in response.json()] == [3]
+    assert "X-Next-Cursor" not in response.headers
+
+    # 不正なカーソルの場合は400が返ることを確認
+    response = client.get("/items/?cursor=invalid")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+# ユーザー一覧取得でN+1が発生しないことのテスト
+def test_read_users_query_count(test_db, test_engine, client):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test1@example.com', 'hashed_password', True),"
+        "(2, 'test2@example.com', 'hashed_password', True),"
+        "(3, 'test3@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1),"
+        "(2, 'Item 2', 'Description 2', 2),"
+        "(3, 'Item 3', 'Description 3', 3)"
+    )
+    test_db.commit()
+
+    # ユーザー数に関わらず、ユーザーとアイテムの2クエリで取得できることを確認
+    with count_queries(test_engine) as counter:
+        response = client.get("/users/")
+    assert response.status_code == 200, response.text
+    assert [len(user["items"]) for user in response.json()] == [1, 1, 1]
+    assert counter.count == 2
+
+    # include_items=false の場合はアイテムを取得せず、レスポンスにも含まれないことを確認
+    with count_queries(test_engine) as counter:
+        response = client.get("/users/?include_items=false&limit=2")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [user["id"] for user in data] == [1, 2]
+    assert all("items" not in user for user in data)
+    assert "X-Next-Cursor" in response.headers
+    assert counter.count == 1
+
+
+# ユーザーの一括取得が、指定したIDの数に関わらずユーザーとアイテムの2クエリで返ることのテスト
+def test_read_users_batch(test_db, test_engine, client, monkeypatch):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test1@example.com', 'hashed_password', True),"
+        "(2, 'test2@example.com', 'hashed_password', True),"
+        "(3, 'test3@example.com', 'hashed_password', False)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1),"
+        "(2, 'Item 2', 'Description 2', 3),"
+        "(3, 'Item 3', 'Description 3', 3)"
+    )
+    test_db.commit()
+
+    # 指定した順に返り、重複したIDと存在しないIDは含まれないことを確認
+    with count_queries(test_engine) as counter:
+        response = client.get("/users/batch?ids=3&ids=1&ids=999&ids=3&ids=2")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [user["id"] for user in data] == [3, 1, 2]
+    assert [len(user["items"]) for user in data] == [2, 1, 0]
+    assert counter.count == 2
+
+    monkeypatch.setattr(settings, "user_batch_max_ids", 2)
+    assert client.get("/users/batch?ids=1&ids=2&ids=3").status_code == 400
+    # 上限は重複をまとめた後のIDの数で判定する
+    assert [user["id"] for user in client.get("/users/batch?ids=1&ids=1&ids=1").json()] == [1]
+    # 重複を含めたIDの数が上限の倍数を超える場合は、まとめる前に拒否する
+    assert client.get("/users/batch?" + "&".join(["ids=1"] * 5)).status_code == 400
+    assert client.get("/users/batch").status_code == 422
+    # 末尾スラッシュ付きでも /users/{user_id} ではなく一括取得として扱われる
+    response = client.get("/users/batch/?ids=2&ids=1")
+    assert response.status_code == 200, response.text
+    assert [user["id"] for user in response.json()] == [2, 1]
+
+
+# スレッドプールのサイズが設定値で起動時に変更されることのテスト
+def test_threadpool_size_is_configurable(monkeypatch):
+    monkeypatch.setattr(settings, "threadpool_size", 123)
+
+    async def total_tokens():
+        return to_thread.current_default_thread_limiter().total_tokens
+
+    with TestClient(app) as client:
+        assert client.portal.call(total_tokens) == 123
+
+
+# 接続プールの上限より多い同時リクエストでも、セッションの終了処理が詰まらずに全て応答することのテスト
+def test_concurrent_requests_exceeding_pool(tmp_path, monkeypatch):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'concurrency.db'}", Settings())
+    router = database.SessionRouter(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    monkeypatch.setattr(database, "session_router", router)
+    for dependency in (get_db, get_read_db, get_write_session_scope):
+        monkeypatch.delitem(app.dependency_overrides, dependency, raising=False)
+    clients = settings.threadpool_size * 3
+    try:
+        with TestClient(app) as client, ThreadPoolExecutor(max_workers=clients) as executor:
+            statuses = list(executor.map(lambda _: client.get("/health-check").status_code, range(clients)))
+    finally:
+        engine.dispose()
+    assert statuses == [200] * clients
+
+
+# 起動時のスキーマ作成を設定で省略できることのテスト
+@pytest.mark.parametrize("schema_setup", [True, False])
+def test_schema_setup_on_startup(monkeypatch, schema_setup):
+    calls = []
+    monkeypatch.setattr(settings, "schema_setup", schema_setup)
+    monkeypatch.setattr(main.migrations, "setup_schema", calls.append)
+    with TestClient(app):
+        pass
+    assert calls == ([main.engine] if schema_setup else [])
+
+
+# アイテムの一括登録APIのテスト
+def test_create_items_for_user_bulk(test_db, client, monkeypatch):
+    response = client.post(
+        "/users/1/items/bulk/",
+        json=[{"title": "Item 1", "description": "Description 1"}, {"title": "Item 2"}],
+    )
+    assert response.status_code == 200, response.text
+    assert response.json() == {"ids": [1, 2]}
+
+    response = client.get("/items/")
+    assert [(item["id"], item["title"], item["owner_id"]) for item in response.json()] == [
+        (1, "Item 1", 1),
+        (2, "Item 2", 1),
+    ]
+
+    # 上限を超えた場合は400が返ることを確認
+    monkeypatch.setattr(settings, "bulk_items_max", 1)
+    response = client.post("/users/1/items/bulk/", json=[{"title": "Item 3"}, {"title": "Item 4"}])
+    assert response.status_code == 400
+
+
+# ユーザー・アイテムのNDJSONエクスポートのテスト
+def test_export_users_and_items(test_db, client):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test1@example.com', 'hashed_password', True),"
+        "(2, 'test2@example.com', 'hashed_password', False)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1),"
+        "(2, 'Item 2', NULL, 2)"
+    )
+    test_db.commit()
+
+    response = client.get("/export/users/")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"id": 1, "email": "test1@example.com", "is_active": True},
+        {"id": 2, "email": "test2@example.com", "is_active": False},
+    ]
+
+    response = client.get("/export/items/")
+    assert response.status_code == 200, response.text
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"id": 1, "title": "Item 1", "description": "Description 1", "owner_id": 1},
+        {"id": 2, "title": "Item 2", "description": None, "owner_id": 2},
+    ]
+
+
+# アイテム検索APIでカーソルによるページネーションができることのテスト
+def test_search_items(test_db, client):
+    for title in ["Buy milk", "Buy eggs", "Buy bread"]:
+        response = client.post("/users/1/items/", json={"title": title})
+        assert response.status_code == 200, response.text
+
+    response = client.get("/items/search/?q=buy&limit=2")
+    assert response.status_code == 200, response.text
+    first_page = [item["title"] for item in response.json()]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/items/search/?q=buy&limit=2&cursor={cursor}")
+    assert response.status_code == 200, response.text
+    second_page = [item["title"] for item in response.json()]
+    assert "X-Next-Cursor" not in response.headers
+    assert sorted(first_page + second_page) == ["Buy bread", "Buy eggs", "Buy milk"]
+
+    response = client.get("/items/search/?q=milk")
+    assert [item["title"] for item in response.json()] == ["Buy milk"]
+
+    response = client.get(f"/items/search/?q=buy&cursor={encode_cursor(1)}")
+    assert response.status_code == 400
+
+
+# response_model による再検証の有無で一覧APIのレスポンスが変わらないことのテスト
+@pytest.mark.parametrize("path", ["/users/", "/users/?include_items=false", "/items/?limit=1", "/me/items/"])
+def test_list_responses_skip_validation(test_db, client, monkeypatch, path):
+    app.dependency_overrides.pop(verify_active_user, None)
+    response = client.post("/users/", json={"email": "test@example.com", "password": "testpassword"})
+    headers = {"X-API-TOKEN": response.json()["x_api_token"]}
+    client.post("/users/1/items/", json={"title": "Item 1"}, headers=headers)
+    client.post("/users/1/items/", json={"title": "Item 2", "description": "Description 2"}, headers=headers)
+
+    monkeypatch.setattr(settings, "skip_response_validation", False)
+    validated = client.get(path, headers=headers)
+    monkeypatch.setattr(settings, "skip_response_validation", True)
+    direct = client.get(path, headers=headers)
+
+    assert validated.status_code == direct.status_code == 200
+    assert validated.json() == direct.json()
+    assert validated.headers.get("X-Next-Cursor") == direct.headers.get("X-Next-Cursor")
+
+
+# /metrics のリクエスト数・クエリ数のカウンタが実際の値と一致することのテスト
+def test_metrics_counters(test_db, test_engine, client):
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1),"
+        "(2, 'Item 2', 'Description 2', 1)"
+    )
+    test_db.commit()
+
+    with count_queries(test_engine) as counter:
+        for _ in range(3):
+            assert client.get("/items/").status_code == 200
+        assert client.get("/items/1").status_code == 404
+    query_count = counter.count
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+
+    route_labels = 'method="GET",route="/items/"'
+    assert f'http_request_duration_seconds_count{{{route_labels},status="200"}} 3' in lines
+    assert f"http_request_db_queries_sum{{{route_labels}}} {float(query_count)!r}" in lines
+    assert f"http_request_db_queries_count{{{route_labels}}} 3" in lines
+    # マッチしないパスはパス毎ではなく unmatched として集計されることを確認
+    assert 'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"} 1' in lines
+    assert "active_user_cache_hits_total 0" in lines
+
+
+# 閾値以上の時間がかかったクエリがログに出力されることのテスト
+def test_slow_query_logging(test_db, client, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_query_threshold_ms", 0)
+    with caplog.at_level("WARNING", logger="sql_app.slow_query"):
+        client.get("/items/")
+    assert any("slow query" in record.getMessage() and "FROM items" in record.getMessage() for record in caplog.records)
+    assert "db_slow_queries_total 0" not in client.get("/metrics").text.splitlines()
+
+
+# 参照系のルートはレプリカから読み、書き込んだユーザーは一定時間プライマリから読むことのテスト
+def test_read_replica_routing(replica_router, monkeypatch):
+    router, timer = replica_router
+    monkeypatch.setattr(database, "session_router", router)
+    for dependency in (get_db, get_read_db, get_write_session_scope, verify_active_user):
+        monkeypatch.delitem(app.dependency_overrides, dependency, raising=False)
+    client = TestClient(app)
+
+    response = client.post("/users/", json={"email": "primary@example.com", "password": "password"})
+    assert response.status_code == 200, response.text
+    user_id = response.json()["user"]["id"]
+    headers = {"X-API-TOKEN": response.json()["x_api_token"]}
+    # レプリカの遅延を再現するため、レプリカには古いデータを入れておく
+    replica = router.replica()
+    replica.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES (:id, 'replica@example.com', 'x', 1)",
+        {"id": user_id},
+    )
+    replica.commit()
+    replica.close()
+
+    # 作成直後はプライマリから読む
+    response = client.get(f"/users/{user_id}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == "primary@example.com"
+
+    # 一定時間経過後はレプリカから読む
+    timer.now += 5.0
+    response = client.get(f"/users/{user_id}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == "replica@example.com"
+
+    # 書き込むと再びプライマリから読む
+    response = client.post(f"/users/{user_id}/items/", json={"title": "item"}, headers=headers)
+    assert response.status_code == 200, response.text
+    response = client.get(f"/users/{user_id}", headers=headers)
+    assert response.json()["email"] == "primary@example.com"
+    assert [item["title"] for item in response.json()["items"]] == ["item"]
+
+
+# 非アクティブ化したユーザーは、レプリカが古いままでも認証に失敗し続けることのテスト
+def test_deactivated_user_rejected_with_lagging_replica(replica_router, monkeypatch):
+    router, timer = replica_router
+    monkeypatch.setattr(database, "session_router", router)
+    for dependency in (get_db, get_read_db, get_write_session_scope, verify_active_user):
+        monkeypatch.delitem(app.dependency_overrides, dependency, raising=False)
+    client = TestClient(app)
+
+    tokens = {}
+    for email in ("admin@example.com", "target@example.com"):
+        response = client.post("/users/", json={"email": email, "password": "password"})
+        assert response.status_code == 200, response.text
+        tokens[response.json()["user"]["id"]] = {"X-API-TOKEN": response.json()["x_api_token"]}
+    admin_id, target_id = tokens
+    # レプリカには非アクティブ化が反映されていない状態を再現する
+    replica = router.replica()
+    replica.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(:admin_id, 'admin@example.com', 'x', 1), (:target_id, 'target@example.com', 'x', 1)",
+        {"admin_id": admin_id, "target_id": target_id},
+    )
+    replica.commit()
+    replica.close()
+    timer.now += 5.0
+
+    assert client.get(f"/users/{target_id}", headers=tokens[target_id]).status_code == 200
+    response = client.delete(f"/users/{target_id}", headers=tokens[admin_id])
+    assert response.status_code == 200, response.text
+
+    # 非アクティブ化されたユーザーは書き込みをしていないためレプリカから読むが、認証はプライマリの値で判定する
+    assert not router.is_sticky(target_id)
+    for _ in range(2):
+        assert client.get(f"/users/{admin_id}", headers=tokens[target_id]).status_code == 401
+
+
+# ユーザー取得APIで、変更が無ければ If-None-Match に304を返し、アイテムの追加で変わることのテスト
+def test_read_user_etag(test_db, client):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES (1, 'test1@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+
+    response = client.get("/users/1")
+    assert response.status_code == 200, response.text
+    etag = response.headers["ETag"]
+
+    with count_queries(test_db.get_bind()) as counter:
+        response = client.get("/users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    # バージョンの確認だけで、ユーザーとアイテムは読み込まない
+    assert counter.count == 1
+
+    assert client.get("/users/999", headers={"If-None-Match": etag}).status_code == 404
+
+    client.post("/users/1/items/", json={"title": "Item 1"})
+    response = client.get("/users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [item["title"] for item in response.json()["items"]] == ["Item 1"]
+
+
+# アイテム一覧APIで、ページ毎のETagによる304と、所有者の移管でETagが変わることのテスト
+@pytest.mark.parametrize("skip_validation", [True, False])
+def test_read_items_etag(test_db, client, monkeypatch, skip_validation):
+    monkeypatch.setattr(settings, "skip_response_validation", skip_validation)
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'test1@example.com', 'hashed_password', True), "
+        "(2, 'test2@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', NULL, 1), (2, 'Item 2', NULL, 2), (3, 'Item 3', NULL, 2)"
+    )
+    test_db.commit()
+
+    response = client.get("/items/?limit=2")
+    assert response.status_code == 200, response.text
+    etag = response.headers["ETag"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/items/?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["X-Next-Cursor"] == cursor
+
+    # 別のページは別のETagになる
+    response = client.get(f"/items/?limit=2&cursor={cursor}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()] == [3]
+
+    response = client.delete("/users/1")
+    assert response.status_code == 200, response.text
+    response = client.get("/items/?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["owner_id"] == 2
+
+
+# ユーザーの所有アイテム数がユーザー取得APIと統計APIで返ることのテスト
+def test_read_user_stats(test_db, client):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES (1, 'test1@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+    client.post("/users/1/items/", json={"title": "Item 1"})
+    client.post("/users/1/items/bulk/", json=[{"title": "Item 2"}, {"title": "Item 3"}])
+
+    response = client.get("/users/1/stats")
+    assert response.status_code == 200, response.text
+    assert response.json() == {"id": 1, "item_count": 3}
+    assert client.get("/users/1").json()["item_count"] == 3
+    assert client.get("/users/999/stats").status_code == 404
+
+
+# アイテム作成をまとめて書き込む場合も、各リクエストが自分のアイテムを受け取り、終了時に失われないことのテスト
+def test_create_items_with_write_coalescing(test_db, test_session_factory, monkeypatch):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES (1, 'test1@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+
+    opened = []
+
+    @contextmanager
+    def test_write_session_scope(key=None):
+        opened.append(key)
+        db = test_session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def request_write_session_scope(key=None):
+        raise AssertionError("item creation must not open a request session while coalescing")
+
+    monkeypatch.setattr(settings, "item_write_coalescing", True)
+    monkeypatch.setattr(settings, "item_write_batch_ms", 50.0)
+    monkeypatch.setattr(main, "write_session_scope", test_write_session_scope)
+    monkeypatch.setitem(app.dependency_overrides, verify_active_user, lambda: None)
+    # まとめて書き込む場合は、リクエスト毎のDBセッションを開かない
+    monkeypatch.setitem(app.dependency_overrides, get_write_session_scope, lambda: request_write_session_scope)
+    monkeypatch.setitem(app.dependency_overrides, get_db, request_write_session_scope)
+
+    with TestClient(app) as client:
+        writer = main.item_writer
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(
+                lambda i: client.post("/users/1/items/", json={"title": f"Item {i}"}), range(20)
+            ))
+    assert main.item_writer is None
+
+    assert all(response.status_code == 200 for response in responses), [response.text for response in responses]
+    created = {response.json()["id"]: response.json()["title"] for response in responses}
+    assert sorted(created.values()) == sorted(f"Item {i}" for i in range(20))
+    assert dict(test_db.execute("SELECT id, title FROM items").fetchall()) == created
+    assert test_db.execute("SELECT item_count FROM users WHERE id = 1").scalar() == 20
+    assert writer.batches < 20
+    assert len(opened) == writer.batches
+
+
+# 公開ルートではトークンを検証せず、認証が必要なルートではリクエスト毎に1度だけ検証することのテスト
+def test_token_decoded_only_on_authenticated_routes(test_db, client, monkeypatch):
+    app.dependency_overrides.pop(verify_active_user, None)
+    decoded = []
+    decode_claims = main.auth_backend.decode_claims
+    monkeypatch.setattr(main.auth_backend, "decode_claims", lambda token: decoded.append(token) or decode_claims(token))
+
+    response = client.post("/users/", json={"email": "test@example.com", "password": "testpassword"})
+    headers = {"X-API-TOKEN": response.json()["x_api_token"]}
+    assert client.get("/health-check", headers=headers).status_code == 200
+    assert client.get("/metrics", headers=headers).status_code == 200
+    assert client.post("/users/", json={"email": "test2@example.com", "password": "testpassword"}, headers=headers).status_code == 200
+    assert decoded == []
+
+    assert client.get("/me/items/", headers=headers).status_code == 200
+    assert decoded == [headers["X-API-TOKEN"]]
@@ -1,5 +1,13 @@
+import multiprocessing
+
 import pytest
-from .. import crud
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..config import settings
+from ..database import Base, create_db_engine
+from ..utils.cache import SQLiteCache
+from ..utils.query_counter import count_queries
 
 
 # アクティブユーザー取得のテスト
@@ -226,3 +234,353 @@ def test_deactivate_user_no_items(test_db):
     cursor = test_db.execute(f"SELECT is_active FROM users WHERE id = {deactivate_user_id}")
     user_status = cursor.fetchone()
     assert user_status[0] == 0
+
+
+# キーセットページネーションでアイテムを取得するテスト
+def test_get_items_after_id(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1), "
+        "(2, 'Item 2', 'Description 2', 2), "
+        "(3, 'Item 3', 'Description 3', 1), "
+        "(4, 'Item 4', 'Description 4', 1), "
+        "(5, 'Item 5', 'Description 5', 2)"
+    )
+    test_db.commit()
+
+    items = crud.get_items(test_db, after_id=2, limit=2)
+    assert [item.id for item in items] == [3, 4]
+
+    items = crud.get_user_items(test_db, user_id=1, after_id=1, limit=10)
+    assert [item.id for item in items] == [3, 4]
+
+    users = crud.get_users(test_db, after_id=1)
+    assert [user.id for user in users] == [2]
+
+
+# アイテムの一括登録で、チャンクを跨いでも登録したIDが順番通りに返ることのテスト
+def test_create_user_items(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(10, 'Item 10', 'Description 10', 1)"
+    )
+    test_db.commit()
+
+    items = [schemas.ItemCreate(title=f"Bulk {i}", description=None if i % 2 else f"Description {i}") for i in range(7)]
+    ids = crud.create_user_items(test_db, items, user_id=1, chunk_size=3)
+    assert ids == list(range(11, 18))
+
+    rows = test_db.execute("SELECT id, title, owner_id FROM items WHERE id > 10 ORDER BY id").fetchall()
+    assert [(row[0], row[1], row[2]) for row in rows] == [(11 + i, f"Bulk {i}", 1) for i in range(7)]
+
+
+# ユーザーの非アクティブ化で、アイテムをチャンク毎にコミットしながら移管するテスト
+def test_deactivate_user_in_batches(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        + ", ".join(f"({i}, 'Item {i}', 'Description {i}', 1)" for i in range(1, 8))
+    )
+    test_db.commit()
+
+    progress = []
+    result = crud.deactivate_user(test_db, user_id=1, transfer_user_id=2, batch_size=3, progress=progress.append)
+    assert result is True
+    assert progress == [3, 6, 7]
+
+    assert test_db.execute("SELECT is_active FROM users WHERE id = 1").scalar() == 0
+    assert test_db.execute("SELECT COUNT(*) FROM items WHERE owner_id = 2").scalar() == 7
+
+
+# 移管が途中で中断された場合、ユーザーはアクティブのまま残り再実行で残りを移管できることのテスト
+def test_deactivate_user_resume_after_interruption(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        + ", ".join(f"({i}, 'Item {i}', 'Description {i}', 1)" for i in range(1, 6))
+    )
+    test_db.commit()
+
+    def interrupt(transferred):
+        raise RuntimeError("interrupted")
+
+    result = crud.deactivate_user(test_db, user_id=1, transfer_user_id=2, batch_size=2, progress=interrupt)
+    assert result is False
+    assert test_db.execute("SELECT is_active FROM users WHERE id = 1").scalar() == 1
+    assert test_db.execute("SELECT COUNT(*) FROM items WHERE owner_id = 2").scalar() == 2
+
+    result = crud.deactivate_user(test_db, user_id=1, transfer_user_id=2, batch_size=2)
+    assert result is True
+    assert test_db.execute("SELECT is_active FROM users WHERE id = 1").scalar() == 0
+    assert test_db.execute("SELECT COUNT(*) FROM items WHERE owner_id = 2").scalar() == 5
+
+
+# パスワードの検証に成功した場合、コスト設定が変わっていれば再ハッシュして保存することのテスト
+def test_authenticate_user_rehashes(test_db, monkeypatch):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'chimichangas4lifenotreallyhashed', True)"
+    )
+    test_db.commit()
+
+    assert crud.authenticate_user(test_db, email="user1@example.com", password="wrong") is None
+    assert crud.authenticate_user(test_db, email="nobody@example.com", password="chimichangas4life") is None
+
+    user = crud.authenticate_user(test_db, email="user1@example.com", password="chimichangas4life")
+    assert user is not None
+    assert user.hashed_password.startswith("scrypt$")
+
+    rehashed = user.hashed_password
+    monkeypatch.setattr(settings, "password_scrypt_n", settings.password_scrypt_n * 2)
+    user = crud.authenticate_user(test_db, email="user1@example.com", password="chimichangas4life")
+    assert user.hashed_password != rehashed
+    assert user.hashed_password.startswith(f"scrypt${settings.password_scrypt_n}$")
+
+
+# 全文検索で、トリガーにより同期された索引からスコア順に取得できることのテスト
+def test_search_items(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+    crud.create_user_item(test_db, schemas.ItemCreate(title="Buy milk", description="milk milk milk"), user_id=1)
+    crud.create_user_items(
+        test_db,
+        [
+            schemas.ItemCreate(title="Buy eggs", description="and some milk"),
+            schemas.ItemCreate(title="Write report", description=None),
+        ],
+        user_id=1,
+    )
+
+    results = crud.search_items(test_db, query="milk")
+    assert [item.id for item, _ in results] == [1, 2]
+    assert results[0][1] < results[1][1]
+
+    # (スコア, id) を起点に続きを取得できることを確認
+    first_page = crud.search_items(test_db, query="milk", limit=1)
+    assert [item.id for item, _ in first_page] == [1]
+    second_page = crud.search_items(test_db, query="milk", limit=1, after=(first_page[0][1], 1))
+    assert [item.id for item, _ in second_page] == [2]
+
+    assert [item.id for item, _ in crud.search_items(test_db, query="buy milk")] == [1, 2]
+
+    # 更新・削除も索引に反映されることを確認
+    test_db.execute("UPDATE items SET title = 'Write milk report' WHERE id = 3")
+    test_db.execute("DELETE FROM items WHERE id = 1")
+    test_db.commit()
+    assert {item.id for item, _ in crud.search_items(test_db, query="milk")} == {2, 3}
+    assert crud.search_items(test_db, query="*") == []
+
+
+# SQLite以外のDBのLIKEによる検索で、% と _ が入力した文字そのものとして扱われることのテスト
+def test_search_items_like_fallback_escapes_wildcards(test_db, monkeypatch):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, '100% milk', NULL, 1), (2, '1000 milk', NULL, 1), (3, 'milk_tea', NULL, 1), (4, 'milkytea', NULL, 1)"
+    )
+    test_db.commit()
+    # memo: LIKE による代替の経路を通すため、DBの種類だけを差し替える
+    monkeypatch.setattr(test_db.get_bind().dialect, "name", "postgresql")
+
+    assert [item.id for item, _ in crud.search_items(test_db, query="100%")] == [1]
+    assert [item.id for item, _ in crud.search_items(test_db, query="milk_tea")] == [3]
+    assert [item.id for item, _ in crud.search_items(test_db, query="milk")] == [1, 2, 3, 4]
+
+
+# アイテムの追加・移管とユーザーの非アクティブ化で、ETag用のバージョンが加算されることのテスト
+def test_versions_are_bumped(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True), "
+        "(3, 'user3@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+    assert crud.get_user_version(test_db, user_id=1) == 1
+    assert crud.get_user_version(test_db, user_id=999) is None
+
+    crud.create_user_item(test_db, schemas.ItemCreate(title="Item 1"), user_id=1)
+    assert crud.get_user_version(test_db, user_id=1) == 2
+    crud.create_user_items(test_db, [schemas.ItemCreate(title="Item 2"), schemas.ItemCreate(title="Item 3")], user_id=1)
+    assert crud.get_user_version(test_db, user_id=1) == 3
+    assert [(row.id, row.version) for row in crud.get_item_versions(test_db)] == [(1, 1), (2, 1), (3, 1)]
+
+    assert crud.deactivate_user(test_db, user_id=1, transfer_user_id=2, batch_size=2)
+    assert crud.get_user_version(test_db, user_id=1) > 3
+    assert crud.get_user_version(test_db, user_id=2) > 1
+    assert crud.get_user_version(test_db, user_id=3) == 1
+    assert [(row.id, row.version) for row in crud.get_item_versions(test_db)] == [(1, 2), (2, 2), (3, 2)]
+
+
+def deactivate_user_in_worker(database_url, cache_path, user_id, transfer_user_id):
+    # 別のワーカープロセスとして、共有キャッシュを使ってユーザーを非アクティブ化する
+    crud.active_user_cache = SQLiteCache(cache_path, maxsize=10, ttl=60)
+    engine = create_db_engine(database_url)
+    db = Session(bind=engine)
+    try:
+        return crud.deactivate_user(db, user_id=user_id, transfer_user_id=transfer_user_id)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+# 共有キャッシュを使う場合、別のワーカーで非アクティブ化したユーザーが即座にアクティブでなくなることのテスト
+def test_active_user_cache_shared_across_workers(tmp_path, monkeypatch):
+    database_url = f"sqlite:///{tmp_path / 'app.db'}"
+    cache_path = str(tmp_path / "cache.db")
+    engine = create_db_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(crud, "active_user_cache", SQLiteCache(cache_path, maxsize=10, ttl=60))
+    db = Session(bind=engine)
+    try:
+        db.execute(
+            "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+            "(1, 'user1@example.com', 'hashed_password', True), "
+            "(2, 'user2@example.com', 'hashed_password', True)"
+        )
+        db.commit()
+        assert crud.get_active_user_cached(db, user_id=2).is_active is True
+        assert crud.get_active_user_cached(db, user_id=2).id == 2
+        assert crud.active_user_cache.stats()["hits"] == 1
+
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            assert pool.apply(deactivate_user_in_worker, (database_url, cache_path, 2, 1)) is True
+
+        assert crud.get_active_user_cached(db, user_id=2) is None
+    finally:
+        db.close()
+        engine.dispose()
+
+
+# アイテムの追加・一括登録・移管で所有アイテム数が更新され、実際の件数と一致することのテスト
+def test_item_count_is_maintained(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+
+    crud.create_user_item(test_db, schemas.ItemCreate(title="Item 1"), user_id=1)
+    crud.create_user_items(test_db, [schemas.ItemCreate(title=f"Item {i}") for i in range(2, 6)], user_id=1)
+    crud.create_user_item(test_db, schemas.ItemCreate(title="Item 6"), user_id=2)
+    assert tuple(crud.get_user_stats(test_db, user_id=1)) == (1, 5)
+    assert tuple(crud.get_user_stats(test_db, user_id=2)) == (2, 1)
+    assert crud.get_user_stats(test_db, user_id=999) is None
+
+    assert crud.deactivate_user(test_db, user_id=1, transfer_user_id=2, batch_size=2)
+    assert crud.get_user_stats(test_db, user_id=1).item_count == 0
+    assert crud.get_user_stats(test_db, user_id=2).item_count == 6
+    assert crud.find_item_count_mismatches(test_db) == []
+
+
+# 所有アイテム数の不整合を検出し、再計算で修正できることのテスト
+def test_rebuild_item_counts(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', NULL, 1), (2, 'Item 2', NULL, 1)"
+    )
+    test_db.execute("UPDATE users SET item_count = 1 WHERE id = 2")
+    test_db.commit()
+    version = crud.get_user_version(test_db, user_id=1)
+
+    assert crud.find_item_count_mismatches(test_db) == [(1, 0, 2), (2, 1, 0)]
+    assert crud.rebuild_item_counts(test_db) == 2
+    assert crud.find_item_count_mismatches(test_db) == []
+    assert crud.get_user_stats(test_db, user_id=1).item_count == 2
+    assert crud.get_user_version(test_db, user_id=1) == version + 1
+    assert crud.rebuild_item_counts(test_db) == 0
+
+
+# 複数リクエストのアイテムを1トランザクションで登録し、失敗したリクエストにだけエラーを返すテスト
+def test_create_items_batch(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.commit()
+
+    results = crud.create_items_batch(
+        test_db,
+        [(1, schemas.ItemCreate(title="Item 1")), (2, schemas.ItemCreate(title="Item 2")), (1, schemas.ItemCreate(title="Item 3"))],
+    )
+    assert [(item.id, item.title, item.owner_id) for item in results] == [(1, "Item 1", 1), (2, "Item 2", 2), (3, "Item 3", 1)]
+    assert crud.get_user_stats(test_db, user_id=1).item_count == 2
+
+    # 登録できない値を含むリクエストだけがエラーになる
+    results = crud.create_items_batch(
+        test_db,
+        [(1, schemas.ItemCreate(title="Item 4")), (object(), schemas.ItemCreate(title="Broken")), (2, schemas.ItemCreate(title="Item 5"))],
+    )
+    assert isinstance(results[1], Exception)
+    assert [results[0].title, results[2].title] == ["Item 4", "Item 5"]
+    assert [row[0] for row in test_db.execute("SELECT title FROM items ORDER BY id")] == [
+        "Item 1", "Item 2", "Item 3", "Item 4", "Item 5"
+    ]
+    assert crud.find_item_count_mismatches(test_db) == []
+
+
+# ローダーに溜めたユーザーの取得が1回の問い合わせにまとまり、取得済みのユーザーは再度問い合わせないことのテスト
+def test_user_loader_coalesces_lookups(test_db, test_engine, monkeypatch):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True), "
+        "(3, 'user3@example.com', 'hashed_password', True)"
+    )
+    test_db.execute("INSERT INTO items (id, title, description, owner_id) VALUES (1, 'Item 1', NULL, 2)")
+    test_db.commit()
+
+    loader = crud.UserLoader(test_db)
+    with count_queries(test_engine) as counter:
+        first, second, missing = loader.load(2), loader.load(1), loader.load(999)
+        assert counter.count == 0
+        assert first().id == 2
+        assert [item.title for item in first().items] == ["Item 1"]
+        assert second().id == 1
+        assert missing() is None
+    # ユーザーとアイテムの2クエリのみ
+    assert counter.count == 2
+    assert loader.dispatches == 1
+
+    with count_queries(test_engine) as counter:
+        # 取得済みのユーザーは問い合わせず、未取得のユーザー3だけを取得する
+        assert [user and user.id for user in loader.load_many([1, 3, 2, 999])] == [1, 3, 2, None]
+    assert counter.count == 2
+    assert loader.dispatches == 2
+
+    # IN句のパラメータ数の上限を超える場合はチャンクに分けて取得する
+    monkeypatch.setattr(crud, "ID_LOOKUP_CHUNK_SIZE", 2)
+    with count_queries(test_engine) as counter:
+        users = crud.get_users_by_ids(test_db, [1, 2, 3], include_items=False)
+    assert sorted(user.id for user in users) == [1, 2, 3]
+    assert counter.count == 2
@@ -0,0 +1,170 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+
+from starlette.requests import Request
+
+from .. import database
+from ..config import Settings
+from ..database import WROTE_KEY, SessionRouter, check_pool_capacity, create_db_engine
+from ..utils.auth import AuthenticatedUser
+from ..utils.cache import SQLiteCache
+
+
+# SQLiteのファイルDBで接続時にPRAGMAとプール設定が反映されることのテスト
+def test_create_db_engine_sqlite_pragmas(tmp_path):
+    options = Settings(db_pool_size=3, db_max_overflow=2, sqlite_busy_timeout_ms=1234, sqlite_mmap_size=1048576)
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pragma.db'}", options)
+    try:
+        assert isinstance(engine.pool, QueuePool)
+        assert engine.pool.size() == 3
+        with engine.connect() as conn:
+            assert conn.execute("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.execute("PRAGMA synchronous").scalar() == 1  # NORMAL
+            assert conn.execute("PRAGMA busy_timeout").scalar() == 1234
+            assert conn.execute("PRAGMA mmap_size").scalar() == 1048576
+    finally:
+        engine.dispose()
+
+
+# プールサイズを指定しない場合、ファイルのSQLiteはSQLAlchemyの既定(NullPool)のままになることのテスト
+def test_create_db_engine_sqlite_default_pool(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'nullpool.db'}", Settings())
+    try:
+        assert isinstance(engine.pool, NullPool)
+    finally:
+        engine.dispose()
+
+
+# プールの上限がスレッドプールのサイズより小さい設定を拒否することのテスト
+def test_check_pool_capacity():
+    check_pool_capacity(Settings(threadpool_size=40))
+    check_pool_capacity(Settings(threadpool_size=40, db_pool_size=30, db_max_overflow=10))
+    check_pool_capacity(Settings(threadpool_size=40, db_pool_size=5, db_max_overflow=-1))
+    with pytest.raises(ValueError):
+        check_pool_capacity(Settings(threadpool_size=40, db_pool_size=5, db_max_overflow=10))
+
+
+# WALなどを無効化した場合はSQLiteの既定値のままになることのテスト
+def test_create_db_engine_sqlite_pragmas_disabled(tmp_path):
+    options = Settings(sqlite_wal=False, sqlite_synchronous=None, sqlite_mmap_size=0)
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'default.db'}", options)
+    try:
+        with engine.connect() as conn:
+            assert conn.execute("PRAGMA journal_mode").scalar() == "delete"
+            assert conn.execute("PRAGMA synchronous").scalar() == 2  # FULL
+    finally:
+        engine.dispose()
+
+
+# インメモリDBの場合はWALを設定しないことのテスト
+def test_create_db_engine_sqlite_memory():
+    engine = create_db_engine("sqlite://")
+    try:
+        with engine.connect() as conn:
+            assert conn.execute("PRAGMA journal_mode").scalar() == "memory"
+    finally:
+        engine.dispose()
+
+
+# 不正なsynchronousを指定した場合のテスト
+def test_create_db_engine_invalid_synchronous(tmp_path):
+    with pytest.raises(ValueError):
+        create_db_engine(f"sqlite:///{tmp_path / 'invalid.db'}", Settings(sqlite_synchronous="FAST"))
+
+
+# レプリカが設定されている場合は読み込みがレプリカ、書き込み後の一定時間はプライマリになることのテスト
+def test_session_router_read_your_writes(replica_router):
+    router, timer = replica_router
+
+    db = router.read_session(1)
+    assert db.get_bind() is router.replica.kw["bind"]
+    db.close()
+
+    db = router.write_session()
+    assert db.get_bind() is router.primary.kw["bind"]
+    db.execute("INSERT INTO users (email, hashed_password, is_active) VALUES ('a@example.com', 'x', 1)")
+    db.commit()
+    assert db.info[WROTE_KEY] is True
+    db.close()
+
+    router.mark_write(1)
+    assert router.is_sticky(1)
+    assert not router.is_sticky(2)
+    assert not router.is_sticky(None)
+    db = router.read_session(1)
+    assert db.get_bind() is router.primary.kw["bind"]
+    db.close()
+
+    timer.now += 5.0
+    assert not router.is_sticky(1)
+    db = router.read_session(1)
+    assert db.get_bind() is router.replica.kw["bind"]
+    db.close()
+
+
+# 書き込んだユーザーは、リクエストの終了処理(レスポンス送信後)を待たずにコミットした時点でプライマリから読むことのテスト
+def test_get_db_marks_writer_on_commit(replica_router, monkeypatch):
+    router, _ = replica_router
+    monkeypatch.setattr(database, "session_router", router)
+    request = Request({"type": "http", "user": AuthenticatedUser(user_id=1)})
+
+    dependency = database.get_db(request)
+    db = next(dependency)
+    db.execute("INSERT INTO users (email, hashed_password, is_active) VALUES ('a@example.com', 'x', 1)")
+    db.commit()
+    # 終了処理の前に、読み込みがプライマリに振り分けられる
+    assert router.is_sticky(1)
+    assert router.read_session(1).get_bind() is router.primary.kw["bind"]
+    dependency.close()
+
+
+# 読み込みだけのセッションは書き込みの目印が付かないことのテスト
+def test_session_router_write_session_without_commit(replica_router):
+    router, _ = replica_router
+    db = router.write_session()
+    db.execute("SELECT 1")
+    db.rollback()
+    assert WROTE_KEY not in db.info
+    db.close()
+
+
+# 共有キャッシュを使う場合は、別のワーカーで書き込んだユーザーもプライマリから読むことのテスト
+def test_session_router_shares_recent_writers(replica_router, tmp_path):
+    router, _ = replica_router
+    # 2つのワーカーを、同じファイルの SQLiteCache を使う別々のルーターで再現する
+    workers = [
+        SessionRouter(
+            router.primary,
+            router.replica,
+            read_your_writes_seconds=5.0,
+            recent_writers=SQLiteCache(str(tmp_path / "cache.db"), maxsize=100, ttl=5.0, table="recent_writers"),
+        )
+        for _ in range(2)
+    ]
+    db = workers[0].write_session(1)
+    db.execute("INSERT INTO users (email, hashed_password, is_active) VALUES ('a@example.com', 'x', 1)")
+    db.commit()
+    db.close()
+
+    assert workers[1].is_sticky(1)
+    db = workers[1].read_session(1)
+    assert db.get_bind() is router.primary.kw["bind"]
+    db.close()
+    assert not workers[1].is_sticky(2)
+    for worker in workers:
+        worker.recent_writers.close()
+
+
+# レプリカが無い場合は読み込みもプライマリを使うことのテスト
+def test_session_router_without_replica(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    try:
+        router = SessionRouter(sessionmaker(bind=engine), read_your_writes_seconds=5.0)
+        router.mark_write(1)
+        assert router.recent_writers is None
+        db = router.read_session(2)
+        assert db.get_bind() is engine
+        db.close()
+    finally:
+        engine.dispose()
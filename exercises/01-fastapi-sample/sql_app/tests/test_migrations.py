@@ -0,0 +1,212 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from .. import crud
+from ..migrations import (
+    SCHEMA_VERSION,
+    migrate,
+    migrate_columns,
+    migrate_indexes,
+    migrate_item_search,
+    schema_version,
+    setup_schema,
+)
+from ..utils.query_counter import count_queries
+
+
+def query_plans(db, counter):
+    conn = db.connection()
+    for statement, parameters in zip(counter.statements, counter.parameters):
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        yield statement, [row[-1] for row in rows]
+
+
+@pytest.fixture()
+def seeded_db(test_db):
+    test_db.execute(
+        "INSERT INTO users (id, email, hashed_password, is_active) VALUES "
+        "(1, 'user1@example.com', 'hashed_password', True), "
+        "(2, 'user2@example.com', 'hashed_password', True)"
+    )
+    test_db.execute(
+        "INSERT INTO items (id, title, description, owner_id) VALUES "
+        "(1, 'Item 1', 'Description 1', 1), "
+        "(2, 'Item 2', 'Description 2', 2)"
+    )
+    test_db.commit()
+    return test_db
+
+
+USERS_PK = "SEARCH users USING INTEGER PRIMARY KEY (rowid=?)"
+ITEMS_BY_OWNER = "SEARCH items USING INDEX ix_items_owner_id_id (owner_id=?)"
+ITEMS_BY_OWNER_AFTER = "SEARCH items USING COVERING INDEX ix_items_owner_id_id (owner_id=? AND id>?)"
+
+
+# crudのクエリが想定したインデックスを使うことのテスト(クエリ毎の EXPLAIN QUERY PLAN の各行の先頭と比較する)
+# memo: offset によるページングとエクスポートは全件を id 順に読むため、主キー順の SCAN(一時B-treeによるソート無し)を想定する
+@pytest.mark.parametrize(
+    "run, expected_plans",
+    [
+        (lambda db: crud.get_user(db, user_id=1), [[USERS_PK]]),
+        (lambda db: crud.get_active_user(db, user_id=1), [[USERS_PK]]),
+        (
+            lambda db: crud.get_active_user_with_min_id_excluding(db, exclude_user_id=1),
+            [["SEARCH users USING INDEX ix_users_is_active_id (is_active=?)"]],
+        ),
+        (
+            lambda db: crud.get_user_by_email(db, email="user1@example.com"),
+            [["SEARCH users USING INDEX ix_users_email (email=?)"]],
+        ),
+        (lambda db: crud.get_user_version(db, user_id=1), [[USERS_PK]]),
+        (lambda db: crud.get_user_stats(db, user_id=1), [[USERS_PK]]),
+        (
+            lambda db: crud.get_users(db, after_id=0),
+            [["SEARCH users USING INTEGER PRIMARY KEY (rowid>?)"], [ITEMS_BY_OWNER]],
+        ),
+        (lambda db: crud.get_users(db, skip=1), [["SCAN users"], [ITEMS_BY_OWNER]]),
+        (lambda db: crud.get_items(db, after_id=0), [["SEARCH items USING INTEGER PRIMARY KEY (rowid>?)"]]),
+        (lambda db: crud.get_items(db, skip=1), [["SCAN items"]]),
+        (lambda db: crud.get_item_versions(db, after_id=0), [["SEARCH items USING INTEGER PRIMARY KEY (rowid>?)"]]),
+        (lambda db: crud.get_item_versions(db, skip=1), [["SCAN items"]]),
+        (lambda db: crud.get_user_items(db, user_id=1), [[ITEMS_BY_OWNER]]),
+        (
+            lambda db: crud.get_user_items(db, user_id=1, after_id=0),
+            [["SEARCH items USING INDEX ix_items_owner_id_id (owner_id=? AND id>?)"]],
+        ),
+        (lambda db: crud.get_users_by_ids(db, [1, 2]), [[USERS_PK], [ITEMS_BY_OWNER]]),
+        (lambda db: crud.get_users_by_ids(db, [1, 2], include_items=False), [[USERS_PK]]),
+        (lambda db: list(crud.iter_users_for_export(db)), [["SCAN users"]]),
+        (lambda db: list(crud.iter_items_for_export(db)), [["SCAN items"]]),
+        # 全文検索は items_fts の MATCH で絞り込み、スコア順に並べるため一時B-treeでソートする
+        (
+            lambda db: crud.search_items(db, "Item"),
+            [[
+                "SCAN items_fts VIRTUAL TABLE INDEX 0:M",
+                "SEARCH items USING INTEGER PRIMARY KEY (rowid=?)",
+                "USE TEMP B-TREE FOR ORDER BY",
+            ]],
+        ),
+        (
+            lambda db: crud.deactivate_user(db, user_id=1, transfer_user_id=2, batch_size=1),
+            [
+                [ITEMS_BY_OWNER_AFTER],
+                ["SEARCH items USING INTEGER PRIMARY KEY (rowid=?)"],
+                [USERS_PK],
+                [USERS_PK],
+                [ITEMS_BY_OWNER_AFTER],
+                [ITEMS_BY_OWNER],
+                [USERS_PK],
+            ],
+        ),
+    ],
+)
+def test_crud_queries_use_index(seeded_db, test_engine, run, expected_plans):
+    with count_queries(test_engine) as counter:
+        run(seeded_db)
+
+    plans = list(query_plans(seeded_db, counter))
+    assert len(plans) == len(expected_plans), plans
+    for (statement, plan), expected in zip(plans, expected_plans):
+        assert len(plan) == len(expected), (statement, plan)
+        for detail, prefix in zip(plan, expected):
+            assert detail.startswith(prefix), (statement, plan)
+
+
+# 既存のDBに対して、不要なインデックスの削除と新しいインデックスの作成が行われることのテスト
+def test_migrate_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, hashed_password VARCHAR, is_active BOOLEAN)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, owner_id INTEGER)"
+        )
+        conn.exec_driver_sql("CREATE INDEX ix_users_id ON users (id)")
+        conn.exec_driver_sql("CREATE UNIQUE INDEX ix_users_email ON users (email)")
+        conn.exec_driver_sql("CREATE INDEX ix_items_id ON items (id)")
+        conn.exec_driver_sql("CREATE INDEX ix_items_title ON items (title)")
+        conn.exec_driver_sql("CREATE INDEX ix_items_description ON items (description)")
+
+    applied = migrate_indexes(engine)
+    assert "drop ix_items_description" in applied
+    assert "create ix_items_owner_id_id" in applied
+
+    inspector = inspect(engine)
+    assert {index["name"] for index in inspector.get_indexes("users")} == {"ix_users_email", "ix_users_is_active_id"}
+    assert {index["name"] for index in inspector.get_indexes("items")} == {"ix_items_owner_id_id"}
+
+    # 2回目の実行では何も変更されないことを確認
+    assert migrate_indexes(engine) == []
+    engine.dispose()
+
+
+# 全文検索用テーブルの無い既存のDBに対して、テーブルを作成し既存のアイテムから索引を構築することのテスト
+def test_migrate_item_search(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, owner_id INTEGER)"
+        )
+        conn.exec_driver_sql("INSERT INTO items (id, title, description, owner_id) VALUES (1, 'Buy milk', NULL, 1)")
+
+    assert migrate_item_search(engine) == ["create items_fts"]
+    assert migrate_item_search(engine) == []
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO items (id, title, description, owner_id) VALUES (2, 'More milk', NULL, 1)")
+        rows = conn.exec_driver_sql("SELECT rowid FROM items_fts WHERE items_fts MATCH 'milk' ORDER BY rowid").fetchall()
+    assert [row[0] for row in rows] == [1, 2]
+    engine.dispose()
+
+
+# 既存のDBに対して、ETag用のversion列などが既定値で追加されることのテスト
+def test_migrate_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, hashed_password VARCHAR, is_active BOOLEAN)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, owner_id INTEGER)"
+        )
+        conn.exec_driver_sql("INSERT INTO users (id, email) VALUES (1, 'user1@example.com')")
+
+    assert migrate_columns(engine) == ["add users.version", "add items.version", "add users.item_count"]
+    assert migrate_columns(engine) == []
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT version FROM users WHERE id = 1").scalar() == 1
+
+
+# item_count 列を追加した場合は、既存のアイテムから所有アイテム数が集計されることのテスト
+def test_migrate_item_counts(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, hashed_password VARCHAR, is_active BOOLEAN)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, owner_id INTEGER)"
+        )
+        conn.exec_driver_sql("INSERT INTO users (id, email) VALUES (1, 'user1@example.com'), (2, 'user2@example.com')")
+        conn.exec_driver_sql("INSERT INTO items (id, title, owner_id) VALUES (1, 'Item 1', 1), (2, 'Item 2', 1)")
+
+    assert "rebuild users.item_count" in migrate(engine)
+    assert "rebuild users.item_count" not in migrate(engine)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT id, item_count FROM users ORDER BY id").fetchall() == [(1, 2), (2, 0)]
+    engine.dispose()
+
+
+# 起動時のスキーマ作成で、スキーマのバージョンが最新の場合は確認を省略することのテスト
+def test_setup_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    assert schema_version(engine) == 0
+    setup_schema(engine)
+    assert schema_version(engine) == SCHEMA_VERSION
+    assert {"users", "items", "items_fts"} <= set(inspect(engine).get_table_names())
+
+    with count_queries(engine) as counter:
+        assert setup_schema(engine) == []
+    assert counter.statements == ["PRAGMA user_version"]
+    engine.dispose()
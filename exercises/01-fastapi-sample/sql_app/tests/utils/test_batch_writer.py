@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+import pytest
+
+from ...utils.batch_writer import BatchWriter, BatchWriterClosedError
+
+
+class RecordingFlush:
+    # 書き込まれたペイロードをバッチ毎に記録し、ペイロードを2倍した値を結果として返す
+    def __init__(self, fail=()) -> None:
+        self.batches = []
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+
+    def __call__(self, payloads):
+        with self.lock:
+            self.batches.append(list(payloads))
+        return [ValueError(payload) if payload in self.fail else payload * 2 for payload in payloads]
+
+    @property
+    def payloads(self):
+        return [payload for batch in self.batches for payload in batch]
+
+
+# 同時に投入された書き込みがまとめて書き込まれ、それぞれが自分の結果を受け取ることのテスト
+def test_batch_writer_coalesces_writes():
+    flush = RecordingFlush()
+
+    async def run():
+        writer = BatchWriter(flush, max_size=10, max_delay=0.05)
+        writer.start()
+        results = await asyncio.gather(*(writer.submit(i) for i in range(25)))
+        await writer.close()
+        return results
+
+    assert asyncio.run(run()) == [i * 2 for i in range(25)]
+    assert [len(batch) for batch in flush.batches] == [10, 10, 5]
+
+
+# 1件の書き込みは max_delay 経過後に書き込まれることのテスト
+def test_batch_writer_flushes_after_delay():
+    flush = RecordingFlush()
+
+    async def run():
+        writer = BatchWriter(flush, max_size=10, max_delay=0.01)
+        writer.start()
+        first = await writer.submit(1)
+        second = await writer.submit(2)
+        await writer.close()
+        return first, second
+
+    assert asyncio.run(run()) == (2, 4)
+    assert flush.batches == [[1], [2]]
+
+
+# 失敗した書き込みだけが例外を受け取り、同じバッチの他の書き込みは成功することのテスト
+def test_batch_writer_errors_are_per_request():
+    flush = RecordingFlush(fail={3})
+
+    async def run():
+        writer = BatchWriter(flush, max_size=10, max_delay=0.01)
+        writer.start()
+        results = await asyncio.gather(*(writer.submit(i) for i in range(5)), return_exceptions=True)
+        await writer.close()
+        return results
+
+    results = asyncio.run(run())
+    assert [result for i, result in enumerate(results) if i != 3] == [0, 2, 4, 8]
+    assert isinstance(results[3], ValueError)
+
+
+# バッチ全体の書き込みが例外になった場合は、全てのリクエストに例外が返ることのテスト
+def test_batch_writer_flush_failure():
+    def flush(payloads):
+        raise RuntimeError("database is locked")
+
+    async def run():
+        writer = BatchWriter(flush, max_size=10, max_delay=0.01)
+        writer.start()
+        results = await asyncio.gather(writer.submit(1), writer.submit(2), return_exceptions=True)
+        await writer.close()
+        return results
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+
+# 終了時にキューに残っている書き込みが失われず、重複もせずに全て書き込まれることのテスト
+def test_batch_writer_close_drains_queue():
+    flush = RecordingFlush()
+
+    async def run():
+        writer = BatchWriter(flush, max_size=7, max_delay=1.0)
+        writer.start()
+        tasks = [asyncio.create_task(writer.submit(i)) for i in range(100)]
+        # 書き込みがキューに入った直後に終了する
+        await asyncio.sleep(0)
+        await writer.close()
+        with pytest.raises(BatchWriterClosedError):
+            await writer.submit(100)
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [i * 2 for i in range(100)]
+    assert sorted(flush.payloads) == list(range(100))
+    assert all(len(batch) <= 7 for batch in flush.batches)
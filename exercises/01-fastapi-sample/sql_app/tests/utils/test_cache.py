@@ -0,0 +1,184 @@
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+
+from ...utils.cache import CacheBackend, SQLiteCache, TTLCache, create_cache
+from ..helpers import FakeTimer
+
+
+# ヒット・ミスのカウンタのテスト
+def test_ttl_cache_hit_and_miss():
+    cache = TTLCache(maxsize=2, ttl=10)
+    assert cache.get(1) is None
+    cache.set(1, "a")
+    assert cache.get(1) == "a"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+# 容量を超えた場合に最も使われていないエントリが追い出されることのテスト
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+# TTLを過ぎたエントリが失効することのテスト
+def test_ttl_cache_expiry():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set(1, "a")
+    timer.now = 9.9
+    assert cache.get(1) == "a"
+    timer.now = 10.0
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+# 読み込み中に無効化された場合は古い値を書き戻さないことのテスト
+def test_ttl_cache_set_after_invalidate_is_ignored():
+    cache = TTLCache(maxsize=2, ttl=10)
+    generation = cache.generation()
+    cache.invalidate(1)
+    assert cache.set(1, "stale", generation=generation) is False
+    assert cache.get(1) is None
+
+
+# 共有キャッシュで、値の保存・失効・無効化がインメモリと同じように動くことのテスト
+def test_sqlite_cache(tmp_path):
+    timer = FakeTimer()
+    cache = SQLiteCache(str(tmp_path / "cache.db"), maxsize=10, ttl=10, timer=timer)
+    assert cache.get(1) is None
+    assert cache.set(1, {"id": 1, "is_active": True}) is True
+    assert cache.get(1) == {"id": 1, "is_active": True}
+    # キーの型も区別される
+    assert cache.get("1") is None
+    assert len(cache) == 1
+
+    generation = cache.generation()
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.set(1, "stale", generation=generation) is False
+    assert cache.set(1, "fresh", generation=cache.generation()) is True
+
+    timer.now = 10.0
+    assert cache.get(1) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 4
+
+
+# 同じファイルでも table が異なるキャッシュは、エントリが分かれることのテスト
+def test_sqlite_cache_tables(tmp_path):
+    path = str(tmp_path / "cache.db")
+    users = SQLiteCache(path, maxsize=10, ttl=10)
+    writers = SQLiteCache(path, maxsize=10, ttl=10, table="recent_writers")
+    users.set(1, "user")
+    writers.set(1, True)
+    assert users.get(1) == "user"
+    assert writers.get(1) is True
+    users.clear()
+    assert writers.get(1) is True
+    with pytest.raises(ValueError):
+        SQLiteCache(path, maxsize=10, ttl=10, table="recent writers; --")
+
+
+# 共有キャッシュが maxsize を超えた場合に有効期限の近い順に削除されることのテスト
+def test_sqlite_cache_prune(tmp_path):
+    timer = FakeTimer()
+    cache = SQLiteCache(str(tmp_path / "cache.db"), maxsize=2, ttl=10, timer=timer)
+    for key in range(3):
+        timer.now = key
+        cache.set(key, key)
+    cache.prune()
+    assert cache.get(0) is None
+    assert cache.get(2) == 2
+    assert cache.stats()["evictions"] == 1
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 0
+
+
+# 全スレッドの接続を閉じ、閉じた後に使われた場合は接続し直すことのテスト
+def test_sqlite_cache_close(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), maxsize=10, ttl=10)
+    cache.set(1, "main")
+    thread = threading.Thread(target=lambda: cache.set(2, "worker"))
+    thread.start()
+    thread.join()
+    connections = list(cache._connections)
+    assert len(connections) == 2
+
+    cache.close()
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    assert cache.get(2) == "worker"
+    cache.close()
+
+
+# 抽象メソッドを実装していないキャッシュは、使う前のインスタンス化の時点でエラーになることのテスト
+def test_cache_backend_requires_all_methods():
+    class IncompleteCache(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteCache()
+
+
+# 設定値からキャッシュの実装を選択するテスト
+def test_create_cache(tmp_path):
+    assert isinstance(create_cache("memory", maxsize=1, ttl=1), TTLCache)
+    assert isinstance(create_cache("sqlite", maxsize=1, ttl=1, path=str(tmp_path / "cache.db")), SQLiteCache)
+    with pytest.raises(ValueError):
+        create_cache("sqlite", maxsize=1, ttl=1)
+    with pytest.raises(ValueError):
+        create_cache("redis", maxsize=1, ttl=1)
+
+
+def cache_worker(path, requests, responses):
+    # 別プロセスのワーカーとして、受け取ったメソッドを共有キャッシュに対して実行する
+    cache = SQLiteCache(path, maxsize=10, ttl=60)
+    for method, args in iter(requests.get, None):
+        responses.put(getattr(cache, method)(*args))
+
+
+# 別プロセスで保存・無効化した値が、他のプロセスから即座に見えることのテスト
+def test_sqlite_cache_is_shared_across_processes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(path, maxsize=10, ttl=60)
+    context = multiprocessing.get_context("spawn")
+    requests, responses = context.Queue(), context.Queue()
+    worker = context.Process(target=cache_worker, args=(path, requests, responses))
+    worker.start()
+
+    def call(method, *args):
+        requests.put((method, args))
+        return responses.get(timeout=30)
+
+    try:
+        cache.set(1, {"id": 1, "is_active": True})
+        assert call("get", 1) == {"id": 1, "is_active": True}
+
+        # 読み込み中に他のプロセスで無効化された場合も、古い値は書き戻されない
+        generation = cache.generation()
+        call("invalidate", 1)
+        assert cache.get(1) is None
+        assert cache.set(1, {"id": 1, "is_active": True}, generation=generation) is False
+        assert call("get", 1) is None
+
+        assert call("set", 2, "from worker") is True
+        assert cache.get(2) == "from worker"
+    finally:
+        requests.put(None)
+        worker.join(timeout=30)
+    assert worker.exitcode == 0
@@ -0,0 +1,31 @@
+from ...utils.etag import ETAG_HEADER, etag_matches, make_etag, not_modified
+
+
+# 同じ値からは同じETag、異なる値からは異なるETagが作られることのテスト
+def test_make_etag():
+    etag = make_etag("user", 1, 1)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("user", 1, 1)
+    assert etag != make_etag("user", 1, 2)
+    assert make_etag("items", "1:1", "2:1") != make_etag("items", "1:12", "1")
+
+
+# If-None-Match の判定のテスト(複数指定・弱いETag・*)
+def test_etag_matches():
+    etag = make_etag("user", 1, 1)
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches(f"W/{etag}", etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
+    assert not etag_matches(make_etag("user", 1, 2), etag)
+
+
+# 304レスポンスに本体が無くETagが含まれることのテスト
+def test_not_modified():
+    response = not_modified('"abc"', {"X-Next-Cursor": "cursor"})
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers[ETAG_HEADER] == '"abc"'
+    assert response.headers["X-Next-Cursor"] == "cursor"
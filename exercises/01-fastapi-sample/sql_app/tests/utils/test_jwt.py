@@ -1,7 +1,121 @@
-from ...utils.jwt import jwt_claims, jwt_encode, jwt_decode
+import base64
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from jose import jwt as jose_jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from ...utils import jwt as jwt_module
+from ...utils.jwt import ALGORITHM, SECRET_KEY, jwt_claims, jwt_encode, jwt_decode
 from ... import models
 
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+
 # jwt_claimsのテスト
 def test_jwt_claims_user():
     user = models.User(id=1, email="test@example.com")
     assert jwt_claims(user) == {"user_id": 1}
+
+
+# アプリケーションのimport時には python-jose の暗号バックエンドを読み込まないことのテスト
+def test_jose_is_imported_lazily():
+    code = (
+        "import sys\n"
+        "import sql_app.main\n"
+        "from sql_app.utils import jwt_encode\n"
+        "assert 'jose.jwt' not in sys.modules, 'imported at startup'\n"
+        "jwt_encode({'user_id': 1})\n"
+        "assert 'jose.jwt' in sys.modules\n"
+    )
+    env = {**os.environ, "SQL_APP_DATABASE_URL": "sqlite://"}
+    subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=env, check=True)
+
+
+def b64(data) -> str:
+    if not isinstance(data, bytes):
+        data = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def sign(header, payload, key: str = SECRET_KEY) -> str:
+    # ヘッダーとペイロードを任意の値にしたトークンを作る
+    signing_input = f"{b64(header)}.{b64(payload)}"
+    signature = hmac.new(key.encode(), signing_input.encode(), hashlib.sha256).digest()
+    return f"{signing_input}.{b64(signature)}"
+
+
+HS256 = {"alg": "HS256", "typ": "JWT"}
+VALID = sign(HS256, {"user_id": 1})
+NOW = int(time.time())
+
+CONFORMANCE_TOKENS = {
+    "valid": VALID,
+    "valid (jose)": jwt_encode({"user_id": 1, "name": "deadpool"}),
+    "header without typ": sign({"alg": "HS256"}, {"user_id": 1}),
+    "exp in future": sign(HS256, {"user_id": 1, "exp": NOW + 3600}),
+    "exp in past": sign(HS256, {"user_id": 1, "exp": NOW - 10}),
+    "exp float": sign(HS256, {"user_id": 1, "exp": NOW + 3600.5}),
+    "exp string": sign(HS256, {"user_id": 1, "exp": "soon"}),
+    "exp bool": sign(HS256, {"user_id": 1, "exp": True}),
+    "iat string": sign(HS256, {"user_id": 1, "iat": "now"}),
+    "nbf in future": sign(HS256, {"user_id": 1, "nbf": NOW + 3600}),
+    "aud": sign(HS256, {"user_id": 1, "aud": "someone"}),
+    "sub int": sign(HS256, {"user_id": 1, "sub": 1}),
+    "jti int": sign(HS256, {"user_id": 1, "jti": 1}),
+    "no user_id": sign(HS256, {}),
+    "wrong key": sign(HS256, {"user_id": 1}, key="otherkey"),
+    "tampered payload": f"{b64(HS256)}.{b64({'user_id': 2})}.{VALID.rsplit('.', 1)[1]}",
+    "truncated signature": VALID[:-2],
+    "empty signature": VALID.rsplit(".", 1)[0] + ".",
+    "alg none": f"{b64({'alg': 'none'})}.{b64({'user_id': 1})}.",
+    "alg HS512": sign({"alg": "HS512", "typ": "JWT"}, {"user_id": 1}),
+    "no alg": sign({"typ": "JWT"}, {"user_id": 1}),
+    "header list": sign(["HS256"], {"user_id": 1}),
+    "header not json": sign(b"not json", {"user_id": 1}),
+    "payload list": sign(HS256, [1]),
+    "payload string": sign(HS256, "user"),
+    "payload not json": sign(HS256, b"not json"),
+    "payload not utf-8": sign(HS256, b"\xff\xfe"),
+    "two segments": VALID.rsplit(".", 1)[0],
+    "four segments": VALID + ".extra",
+    "bad base64 header": "!!!." + VALID.split(".", 1)[1],
+    "padded segments": ".".join(segment + "=" * (-len(segment) % 4) for segment in VALID.split(".")),
+    "whitespace": f" {VALID} ",
+    "non ascii": VALID + "é",
+    "empty": "",
+    "garbage": "invalid_token",
+}
+
+
+def decode_outcome(decode, token):
+    try:
+        return ("ok", decode(token))
+    except Exception as exc:
+        return ("error", type(exc))
+
+
+# python-jose と同じトークンを受け付け、同じ種類の例外で拒否することのテスト
+@pytest.mark.parametrize("name", list(CONFORMANCE_TOKENS))
+def test_jwt_decode_conforms_to_jose(name):
+    token = CONFORMANCE_TOKENS[name]
+    expected = decode_outcome(lambda token: jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]), token)
+    assert decode_outcome(jwt_decode, token) == expected
+
+
+# 通常のトークンは python-jose を使わずに検証されることのテスト
+def test_jwt_decode_fast_path():
+    with patch.object(jwt_module, "jose_decode", side_effect=AssertionError("fallback")):
+        assert jwt_decode(VALID) == {"user_id": 1}
+        assert jwt_decode(CONFORMANCE_TOKENS["exp in future"])["user_id"] == 1
+        with pytest.raises(ExpiredSignatureError):
+            jwt_decode(CONFORMANCE_TOKENS["exp in past"])
+        with pytest.raises(JWTError):
+            jwt_decode(CONFORMANCE_TOKENS["wrong key"])
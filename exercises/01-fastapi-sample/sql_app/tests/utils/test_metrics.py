@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from ...config import settings
+from ...utils.metrics import install_query_listeners, registry
+
+
+# 失敗した文の開始時刻が接続に残らず、後続の文の計測が自身の実行時間で行われることのテスト
+def test_query_timing_after_failing_statement(monkeypatch, caplog):
+    install_query_listeners()
+    monkeypatch.setattr(settings, "slow_query_threshold_ms", 1000)
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+        assert conn.info == {}
+
+        queries_total = registry.queries_total
+        with caplog.at_level("WARNING", logger="sql_app.slow_query"):
+            assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert registry.queries_total == queries_total + 1
+        assert not caplog.records
+        assert conn.info == {}
+    engine.dispose()
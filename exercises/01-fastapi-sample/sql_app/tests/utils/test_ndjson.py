@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+from ... import migrations
+from ...database import create_db_engine
+from ...utils.ndjson import iter_ndjson
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+EXPORT_ROWS = 300000
+# エクスポートと同じ crud のイテレーターで全行をNDJSONにし、出力行数とピークRSSの増分(KB)を出力する
+EXPORT_RSS_CODE = """
+import resource, sys
+from sql_app import crud
+from sql_app.database import SessionLocal
+from sql_app.utils.ndjson import iter_ndjson
+db = SessionLocal()
+peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rows = crud.iter_items_for_export(db)
+if sys.argv[1] == "list":
+    rows = rows.all()
+total = sum(chunk.count(b"\\n") for chunk in iter_ndjson(rows))
+print(total, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_before)
+"""
+
+Row = namedtuple("Row", ["id", "title", "description", "owner_id"])
+
+
+# 行がNDJSONとしてbatch_size行ずつ出力されることのテスト
+def test_iter_ndjson():
+    rows = [Row(1, "Item 1", None, 1), Row(2, "アイテム2", "Description 2", 1), Row(3, "Item 3", None, 2)]
+    chunks = list(iter_ndjson(rows, batch_size=2))
+    assert len(chunks) == 2
+    lines = b"".join(chunks).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [row._asdict() for row in rows]
+
+
+# エクスポート用のクエリで大量の行を出力しても、ピークRSSが行数に比例して増えないことのテスト
+# memo: ru_maxrss はプロセス全体のピーク値(KB)のため、他のテストの影響を受けないよう新しいプロセスで計測する
+def test_export_peak_rss_is_bounded(tmp_path):
+    url = f"sqlite:///{tmp_path / 'export.db'}"
+    engine = create_db_engine(url)
+    migrations.setup_schema(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO users (id, email, hashed_password) VALUES (1, 'owner@example.com', 'x')")
+        conn.exec_driver_sql(
+            "WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?) "
+            "INSERT INTO items (id, title, description, owner_id) "
+            "SELECT i, 'Item ' || i, 'Description ' || i, 1 FROM seq",
+            (EXPORT_ROWS,),
+        )
+    engine.dispose()
+
+    def peak_rss_growth(mode: str) -> int:
+        env = {**os.environ, "SQL_APP_DATABASE_URL": url}
+        result = subprocess.run(
+            [sys.executable, "-c", EXPORT_RSS_CODE, mode], cwd=PROJECT_ROOT, env=env, check=True, stdout=subprocess.PIPE
+        )
+        total, growth = map(int, result.stdout.split())
+        assert total == EXPORT_ROWS
+        return growth
+
+    # 全行をメモリに載せると100MB程度になるため、20MBを上限とする
+    assert peak_rss_growth("stream") < 20 * 1024
+    # 計測が機能していることの確認として、全行を取得した場合は上限を超えることを確認する
+    assert peak_rss_growth("list") > 20 * 1024
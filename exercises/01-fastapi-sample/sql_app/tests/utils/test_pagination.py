@@ -0,0 +1,44 @@
+import pytest
+
+from ...utils.pagination import (
+    InvalidCursorError,
+    decode_cursor,
+    decode_rank_cursor,
+    encode_cursor,
+    encode_rank_cursor,
+    next_cursor,
+)
+from ... import models
+
+
+# カーソルのエンコード・デコードが往復できることのテスト
+def test_cursor_round_trip():
+    cursor = encode_cursor(12345)
+    assert "12345" not in cursor
+    assert decode_cursor(cursor) == 12345
+
+
+# 不正なカーソルの場合のテスト
+@pytest.mark.parametrize("cursor", ["", "!!!", encode_cursor(1)[:-1] + "*", "aWQ6YWJj"])
+def test_decode_cursor_invalid(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
+
+
+# 取得件数がlimitに満たない場合は次のカーソルが無いことのテスト
+def test_next_cursor():
+    rows = [models.Item(id=1), models.Item(id=5)]
+    assert decode_cursor(next_cursor(rows, limit=2)) == 5
+    assert next_cursor(rows, limit=3) is None
+    assert next_cursor([], limit=0) is None
+
+
+# 検索用カーソル(スコア, id)のエンコード・デコードのテスト
+def test_rank_cursor_round_trip():
+    cursor = encode_rank_cursor(-1.2345678901234567e-06, 42)
+    assert decode_rank_cursor(cursor) == (-1.2345678901234567e-06, 42)
+
+    with pytest.raises(InvalidCursorError):
+        decode_rank_cursor(encode_cursor(42))
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
@@ -0,0 +1,44 @@
+import pytest
+
+from ...config import settings
+from ...utils import password
+from ...utils.password import hash_password, needs_rehash, shutdown_executor, verify_password
+
+
+# ハッシュ化したパスワードを検証できることのテスト
+@pytest.mark.parametrize("algorithm", ["scrypt", "pbkdf2_sha256"])
+def test_hash_and_verify_password(monkeypatch, algorithm):
+    monkeypatch.setattr(settings, "password_hash_algorithm", algorithm)
+    monkeypatch.setattr(settings, "password_pbkdf2_iterations", 1000)
+
+    hashed = hash_password("chimichangas4life")
+    assert hashed.startswith(f"{algorithm}$")
+    assert "chimichangas4life" not in hashed
+    assert hashed != hash_password("chimichangas4life")
+    assert verify_password("chimichangas4life", hashed) is True
+    assert verify_password("wrong", hashed) is False
+    assert needs_rehash(hashed) is False
+
+
+# コストのパラメータが変わった場合と、旧形式のパスワードの場合は再ハッシュが必要になることのテスト
+def test_needs_rehash(monkeypatch):
+    hashed = hash_password("chimichangas4life")
+    monkeypatch.setattr(settings, "password_scrypt_n", settings.password_scrypt_n * 2)
+    assert needs_rehash(hashed) is True
+    assert verify_password("chimichangas4life", hashed) is True
+
+    assert needs_rehash("chimichangas4lifenotreallyhashed") is True
+    assert verify_password("chimichangas4life", "chimichangas4lifenotreallyhashed") is True
+    assert verify_password("wrong", "chimichangas4lifenotreallyhashed") is False
+
+
+# プロセスプールでハッシュ化・検証できることのテスト
+def test_hash_password_in_process_pool(monkeypatch):
+    monkeypatch.setattr(settings, "password_hash_workers", 1)
+    try:
+        hashed = hash_password("chimichangas4life")
+        assert password._executor is not None
+        assert verify_password("chimichangas4life", hashed) is True
+    finally:
+        shutdown_executor()
+    assert password._executor is None
@@ -0,0 +1,16 @@
+from ...utils.search import build_match_query, escape_like
+
+
+# 検索文字列がFTS5の構文として解釈されないよう単語毎に引用符で囲まれることのテスト
+def test_build_match_query():
+    assert build_match_query("buy milk") == '"buy" "milk"'
+    assert build_match_query('milk OR "eggs" NEAR(x)*') == '"milk" "OR" "eggs" "NEAR" "x"'
+    assert build_match_query("牛乳 を買う") == '"牛乳" "を買う"'
+    assert build_match_query(" -*() ") == ""
+
+
+# LIKE のワイルドカードとエスケープ文字がエスケープされることのテスト
+def test_escape_like():
+    assert escape_like("milk") == "milk"
+    assert escape_like("100%_off") == "100\\%\\_off"
+    assert escape_like("C:\\temp") == "C:\\\\temp"
@@ -0,0 +1,15 @@
+from ... import models, schemas
+from ...utils.serialization import dump_orm
+
+
+# ORMオブジェクトがネストしたschemaも含めて、検証した場合と同じ辞書になることのテスト
+def test_dump_orm_matches_from_orm():
+    user = models.User(id=1, email="test@example.com", hashed_password="hashed", is_active=True, item_count=2)
+    user.items = [
+        models.Item(id=1, title="Item 1", description="Description 1", owner_id=1),
+        models.Item(id=2, title="Item 2", description=None, owner_id=1),
+    ]
+
+    assert dump_orm(user, schemas.User) == schemas.User.from_orm(user).dict()
+    assert dump_orm(user, schemas.UserSummary) == {"id": 1, "email": "test@example.com", "is_active": True}
+    assert dump_orm(user.items[0], schemas.Item) == schemas.Item.from_orm(user.items[0]).dict()
@@ -1,2 +1,24 @@
-from .auth import *
-from .jwt import *
+import importlib
+from typing import Any
+
+# memo: utils のサブモジュール(python-jose を使う jwt など)を使わない場合にも読み込まれないよう、
+#       パッケージからの名前の参照は初回アクセス時に該当するサブモジュールを読み込む
+_LAZY_ATTRIBUTES = {
+    "AuthenticatedUser": ".auth",
+    "UnauthenticatedUser": ".auth",
+    "ALGORITHM": ".jwt",
+    "SECRET_KEY": ".jwt",
+    "jwt_claims": ".jwt",
+    "jwt_decode": ".jwt",
+    "jwt_encode": ".jwt",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,95 @@
+import asyncio
+from typing import Any, Callable, List, Optional, Tuple
+
+from anyio import to_thread
+
+# キューに入れるとライタータスクを終了させる目印
+_STOP = object()
+
+
+class BatchWriterClosedError(RuntimeError):
+    pass
+
+
+class BatchWriter:
+    # memo: 書き込みをasyncioのキューに溜め、1つのライタータスクが max_delay 秒毎または max_size 件毎に
+    #       flush(ペイロードのリスト) をスレッドプールで呼び出してまとめて書き込む。
+    #       flush はペイロード毎の結果(または例外)のリストを返し、各 submit はそれぞれの結果を受け取る
+    def __init__(self, flush: Callable[[List[Any]], List[Any]], max_size: int = 500, max_delay: float = 0.005) -> None:
+        self.flush = flush
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.batches = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def start(self) -> None:
+        # イベントループ上で呼び出す(アプリケーションの起動時)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, payload: Any) -> Any:
+        # memo: キューに入れた後に呼び出し元がキャンセルされても、payload は書き込まれる(結果を受け取る相手がいないだけ)
+        if self._closed or self._queue is None:
+            raise BatchWriterClosedError("BatchWriter is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((payload, future))
+        return await future
+
+    async def close(self) -> None:
+        # memo: 新しい書き込みの受付を止めてから終了の目印を入れるため、受け付け済みの書き込みは全て書き込まれてから終了する
+        if self._closed:
+            return
+        self._closed = True
+        if self._queue is None or self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+
+    async def _next_batch(self) -> Tuple[List[Tuple[Any, asyncio.Future]], bool]:
+        assert self._queue is not None
+        entry = await self._queue.get()
+        if entry is _STOP:
+            return [], True
+        batch = [entry]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_size:
+            # 既にキューにある分は待たずに取り出し、空になったら期限まで次の書き込みを待つ
+            try:
+                entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    async def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, stopped = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        self.batches += 1
+        try:
+            results = await to_thread.run_sync(self.flush, [payload for payload, _ in batch])
+        except Exception as exc:
+            results = [exc] * len(batch)
+        for (_, future), result in zip(batch, results):
+            # 待っていたリクエストがキャンセルされていても、書き込み自体は行われている
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,272 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class CacheBackend(ABC):
+    # memo: キャッシュの実装を差し替えるためのインターフェース。
+    #       generation は無効化の世代で、読み込み開始後に無効化された値を set で書き戻さないために使う
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def generation(self) -> int:
+        ...
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None, ttl: Optional[float] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def invalidate(self, key: Hashable) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        ...
+
+    def close(self) -> None:
+        # 外部のリソース(接続など)を持つ実装は、アプリケーションの終了時に解放する
+        pass
+
+
+class TTLCache(CacheBackend):
+    # memo: プロセス内で共有する容量制限付きのLRUキャッシュ。各エントリはttl秒で失効する
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 無効化の世代。DB読み込み中に無効化された値をキャッシュへ書き戻さないために使う
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._timer():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            # 読み込み開始後に無効化が発生していた場合は、古い値の可能性があるため保存しない
+            if generation is not None and generation != self._generation:
+                return False
+            if self.maxsize <= 0:
+                return False
+            # ttl を指定した場合はエントリ毎にデフォルトより短い有効期限を設定できる
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+            if ttl <= 0:
+                return False
+            self._data[key] = (self._timer() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+class SQLiteCache(CacheBackend):
+    # memo: 複数のワーカープロセスで共有するSQLiteファイルのキャッシュ。無効化は全ワーカーに即座に反映される。
+    #       プロセス間で共有するため、キーと値はJSONに変換できる値に限り、有効期限は壁時計(time.time)で判定する
+    PRUNE_INTERVAL = 128
+
+    def __init__(
+        self, path: str, maxsize: int, ttl: float, timer: Callable[[], float] = time.time, table: str = "cache_entries"
+    ) -> None:
+        # 同じファイルを複数の用途で共有できるよう、用途毎に table を分ける(maxsize も table 毎)
+        if not table.isidentifier():
+            raise ValueError(f"Invalid cache table name: {table}")
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # スレッド毎の接続(close で全て閉じる)と、close の度に進める世代(閉じた接続を使わないよう接続し直す)
+        self._connections: List[sqlite3.Connection] = []
+        self._epoch = 0
+        self._sets = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        conn = self._connection()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_expires_at ON {table} (expires_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO cache_meta (id, generation) VALUES (0, 0)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # スレッドプール上の同期ルートから呼ばれるため、スレッド毎に接続を持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.epoch != self._epoch:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # キャッシュは失われても再取得できるため、fsyncを省略する
+            conn.execute("PRAGMA synchronous=OFF")
+            with self._lock:
+                self._connections.append(conn)
+                self._local.epoch = self._epoch
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        # 全スレッドの接続を閉じる。閉じた後に使われた場合は、そのスレッドで接続し直す
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._epoch += 1
+        for conn in connections:
+            conn.close()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        row = self._connection().execute(
+            f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (json.dumps(key), self._timer())
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return json.loads(row[0])
+
+    def generation(self) -> int:
+        return self._connection().execute("SELECT generation FROM cache_meta WHERE id = 0").fetchone()[0]
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None, ttl: Optional[float] = None) -> bool:
+        if self.maxsize <= 0:
+            return False
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return False
+        # 世代の確認と書き込みを1文で行い、他のワーカーの無効化との間に古い値が書き戻されないようにする
+        cursor = self._connection().execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) "
+            "SELECT ?, ?, ? WHERE ? IS NULL OR (SELECT generation FROM cache_meta WHERE id = 0) = ?",
+            (json.dumps(key), json.dumps(value), self._timer() + ttl, generation, generation),
+        )
+        with self._lock:
+            self._sets += 1
+            prune = self._sets % self.PRUNE_INTERVAL == 0
+        if prune:
+            self.prune()
+        return cursor.rowcount > 0
+
+    def prune(self) -> None:
+        # 失効したエントリを削除し、maxsize を超えている場合は有効期限の近い順に削除する
+        conn = self._connection()
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (self._timer(),))
+        excess = conn.execute(f"SELECT count(*) FROM {self.table}").fetchone()[0] - self.maxsize
+        if excess > 0:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY expires_at LIMIT ?)",
+                (excess,),
+            )
+            with self._lock:
+                self.evictions += excess
+
+    def _invalidate(self, where: str, parameters: Tuple) -> None:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE cache_meta SET generation = generation + 1 WHERE id = 0")
+            conn.execute(f"DELETE FROM {self.table} {where}", parameters)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, key: Hashable) -> None:
+        self._invalidate("WHERE key = ?", (json.dumps(key),))
+
+    def clear(self) -> None:
+        self._invalidate("", ())
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._connection().execute(
+            f"SELECT count(*) FROM {self.table} WHERE expires_at > ?", (self._timer(),)
+        ).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        # hits/misses/evictions はプロセス毎の値、size は全ワーカーで共有している件数
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+
+CACHE_BACKENDS = ("memory", "sqlite")
+
+
+def create_cache(
+    backend: str, maxsize: int, ttl: float, path: Optional[str] = None, table: str = "cache_entries"
+) -> CacheBackend:
+    # memo: 複数ワーカーで起動する場合は、ワーカー間で無効化が共有される "sqlite" を使う
+    if backend == "memory":
+        return TTLCache(maxsize=maxsize, ttl=ttl)
+    if backend == "sqlite":
+        if not path:
+            raise ValueError("The sqlite cache backend requires a path")
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl, table=table)
+    raise ValueError(f"Invalid cache backend: {backend} (expected one of {', '.join(CACHE_BACKENDS)})")
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..config import settings
+from .query_counter import is_transaction_control
+
+slow_query_logger = logging.getLogger("sql_app.slow_query")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# IN句などで長くなったSQLをログに全て出力しないよう切り詰める
+SLOW_QUERY_LOG_LENGTH = 500
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+# memo: リクエスト毎のクエリ数・時間を集計するため、ミドルウェアでリクエスト単位の集計オブジェクトを設定する。
+#       同期ルートはスレッドプールで実行されるが、contextvars はスレッドにコピーされるため同じオブジェクトを参照できる
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        counts, total = self._series.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total[0]!r}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.request_duration = Histogram(
+                "http_request_duration_seconds", "Request latency by route.", LATENCY_BUCKETS
+            )
+            self.request_queries = Histogram(
+                "http_request_db_queries", "Number of DB queries per request.", QUERY_COUNT_BUCKETS
+            )
+            self.request_query_duration = Histogram(
+                "http_request_db_query_duration_seconds", "Total DB query time per request.", LATENCY_BUCKETS
+            )
+            self.queries_total = 0
+            self.slow_queries_total = 0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        labels = (("method", method), ("route", route))
+        with self._lock:
+            self.request_duration.observe(labels + (("status", str(status)),), seconds)
+            self.request_queries.observe(labels, stats.queries)
+            self.request_query_duration.observe(labels, stats.query_seconds)
+
+    def observe_query(self, seconds: float, slow: bool) -> None:
+        with self._lock:
+            self.queries_total += 1
+            if slow:
+                self.slow_queries_total += 1
+
+    def render(self, counters: Optional[Dict[str, float]] = None) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for histogram in (self.request_duration, self.request_queries, self.request_query_duration):
+                lines.extend(histogram.render())
+            values = {
+                "db_queries_total": self.queries_total,
+                "db_slow_queries_total": self.slow_queries_total,
+                **(counters or {}),
+            }
+        for name, value in values.items():
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# memo: 開始時刻は文毎の実行コンテキストに保持する。失敗した文では after_cursor_execute が呼ばれないため、
+#       接続(conn.info)に積むと値が残り続け、後続の文が誤った開始時刻と組み合わされてしまう
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_start_time", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    if is_transaction_control(statement):
+        return
+    threshold = settings.slow_query_threshold_ms
+    slow = threshold is not None and seconds * 1000 >= threshold
+    if slow:
+        slow_query_logger.warning("slow query (%.1f ms): %s", seconds * 1000, statement[:SLOW_QUERY_LOG_LENGTH])
+    registry.observe_query(seconds, slow)
+
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+
+
+def install_query_listeners(target=Engine) -> None:
+    # memo: 既定では Engine クラスに登録し、テスト用のエンジンを含む全てのエンジンのクエリを計測する
+    if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
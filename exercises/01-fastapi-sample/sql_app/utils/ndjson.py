@@ -0,0 +1,16 @@
+import json
+from typing import Iterable, Iterator
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def iter_ndjson(rows: Iterable, batch_size: int = 1000) -> Iterator[bytes]:
+    # memo: 1行ずつ送ると送信回数が増えるため、batch_size 行ずつまとめて送る。メモリ使用量は batch_size 分で一定
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(row._asdict(), ensure_ascii=False, separators=(",", ":")))
+        if len(buffer) >= batch_size:
+            yield ("\n".join(buffer) + "\n").encode()
+            buffer.clear()
+    if buffer:
+        yield ("\n".join(buffer) + "\n").encode()
@@ -0,0 +1,61 @@
+import base64
+import binascii
+from typing import Optional, Sequence, Tuple
+
+# memo: カーソルの中身はクライアントに依存させないため、不透明な文字列として扱う
+CURSOR_PREFIX = "id:"
+RANK_CURSOR_PREFIX = "rank:"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def _encode(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b"=").decode()
+
+
+def _decode(cursor: str) -> str:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        return base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorError(cursor)
+
+
+def encode_cursor(last_id: int) -> str:
+    return _encode(f"{CURSOR_PREFIX}{last_id}")
+
+
+def decode_cursor(cursor: str) -> int:
+    raw = _decode(cursor)
+    if not raw.startswith(CURSOR_PREFIX):
+        raise InvalidCursorError(cursor)
+    try:
+        return int(raw[len(CURSOR_PREFIX):])
+    except ValueError:
+        raise InvalidCursorError(cursor)
+
+
+def next_cursor(rows: Sequence, limit: int) -> Optional[str]:
+    # 取得件数が limit に満たない場合は最終ページなので次のカーソルは無し
+    if limit <= 0 or len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1].id)
+
+
+# memo: 検索結果はスコア順のため、(スコア, id) の組をカーソルにする。repr で float を誤差無く往復させる
+def encode_rank_cursor(rank: float, last_id: int) -> str:
+    return _encode(f"{RANK_CURSOR_PREFIX}{rank!r}:{last_id}")
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int]:
+    raw = _decode(cursor)
+    if not raw.startswith(RANK_CURSOR_PREFIX):
+        raise InvalidCursorError(cursor)
+    try:
+        rank, last_id = raw[len(RANK_CURSOR_PREFIX):].rsplit(":", 1)
+        return float(rank), int(last_id)
+    except ValueError:
+        raise InvalidCursorError(cursor)
@@ -0,0 +1,116 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from ..config import settings
+
+# memo: 以前の実装で保存されたパスワード(平文 + 固定文字列)。検証時に再ハッシュして移行する
+LEGACY_SUFFIX = "notreallyhashed"
+SALT_BYTES = 16
+ALGORITHMS = ("scrypt", "pbkdf2_sha256")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def current_params() -> Tuple[str, Tuple[int, ...]]:
+    algorithm = settings.password_hash_algorithm
+    if algorithm == "scrypt":
+        return algorithm, (settings.password_scrypt_n, settings.password_scrypt_r, settings.password_scrypt_p)
+    if algorithm == "pbkdf2_sha256":
+        return algorithm, (settings.password_pbkdf2_iterations,)
+    raise ValueError(f"Unsupported password hash algorithm: {algorithm}")
+
+
+def _derive(algorithm: str, params: Tuple[int, ...], password: str, salt: bytes) -> bytes:
+    if algorithm == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+    if algorithm == "pbkdf2_sha256":
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    raise ValueError(f"Unsupported password hash algorithm: {algorithm}")
+
+
+def _parse(hashed: str) -> Optional[Tuple[str, Tuple[int, ...], bytes, bytes]]:
+    parts = hashed.split("$")
+    if len(parts) < 4 or parts[0] not in ALGORITHMS:
+        return None
+    try:
+        params = tuple(int(value) for value in parts[1:-2])
+        return parts[0], params, _b64decode(parts[-2]), _b64decode(parts[-1])
+    except ValueError:
+        return None
+
+
+def hash_password_sync(password: str, algorithm: str, params: Tuple[int, ...]) -> str:
+    salt = os.urandom(SALT_BYTES)
+    derived = _derive(algorithm, params, password, salt)
+    return "$".join([algorithm, *(str(value) for value in params), _b64encode(salt), _b64encode(derived)])
+
+
+def verify_password_sync(password: str, hashed: str) -> bool:
+    parsed = _parse(hashed)
+    if parsed is None:
+        return hmac.compare_digest((password + LEGACY_SUFFIX).encode(), hashed.encode())
+    algorithm, params, salt, expected = parsed
+    try:
+        derived = _derive(algorithm, params, password, salt)
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, expected)
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    # memo: KDFはCPUを占有するため、GILの影響を受けないプロセスプールで計算する。0の場合は呼び出し元で計算する
+    global _executor
+    if settings.password_hash_workers <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.password_hash_workers)
+        return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def hash_password(password: str) -> str:
+    algorithm, params = current_params()
+    executor = get_executor()
+    if executor is None:
+        return hash_password_sync(password, algorithm, params)
+    return executor.submit(hash_password_sync, password, algorithm, params).result()
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    executor = get_executor()
+    if executor is None:
+        return verify_password_sync(password, hashed)
+    return executor.submit(verify_password_sync, password, hashed).result()
+
+
+def needs_rehash(hashed: str) -> bool:
+    # 保存時とアルゴリズムやコストのパラメータが異なる場合は、現在の設定で再ハッシュが必要
+    parsed = _parse(hashed)
+    if parsed is None:
+        return True
+    algorithm, params, _, _ = parsed
+    return (algorithm, params) != current_params()
@@ -0,0 +1,45 @@
+from contextlib import contextmanager
+from typing import Any, Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# memo: トランザクション制御の文(BEGIN/SAVEPOINTなど)はクエリとして数えない
+TRANSACTION_CONTROL_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+
+def is_transaction_control(statement: str) -> bool:
+    return statement.lstrip().upper().startswith(TRANSACTION_CONTROL_PREFIXES)
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+        self.parameters: List[Any] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def reset(self) -> None:
+        self.statements.clear()
+        self.parameters.clear()
+
+
+# memo: N+1 の検知用に、ブロック内で発行されたSQLを記録する（テストでクエリ数をassertする用途）
+@contextmanager
+def count_queries(engine: Engine) -> Iterator[QueryCounter]:
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if is_transaction_control(statement):
+            return
+        counter.statements.append(statement)
+        counter.parameters.append(parameters)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
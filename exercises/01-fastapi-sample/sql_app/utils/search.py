@@ -0,0 +1,16 @@
+import re
+
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(text: str) -> str:
+    # memo: 入力をそのまま MATCH に渡すとFTS5の構文(AND/OR/NEAR, 記号)として解釈されるため、単語毎に引用符で囲みAND検索にする
+    return " ".join(f'"{term}"' for term in _TERM_PATTERN.findall(text))
+
+
+LIKE_ESCAPE = "\\"
+
+
+def escape_like(text: str) -> str:
+    # memo: LIKE のワイルドカード(%, _)とエスケープ文字自体を、入力した文字そのものとして一致させる
+    return text.replace(LIKE_ESCAPE, LIKE_ESCAPE * 2).replace("%", LIKE_ESCAPE + "%").replace("_", LIKE_ESCAPE + "_")
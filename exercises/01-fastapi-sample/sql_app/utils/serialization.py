@@ -0,0 +1,19 @@
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+
+def dump_orm(obj: Any, schema: Type[BaseModel]) -> Dict[str, Any]:
+    # memo: DBから取得したORMオブジェクトは型が保証されているため、pydanticの検証を通さずschemaのフィールドだけを辞書にする
+    data = {}
+    for name, field in schema.__fields__.items():
+        value = getattr(obj, name)
+        nested = field.type_
+        if value is not None and isinstance(nested, type) and issubclass(nested, BaseModel):
+            if field.shape == SHAPE_SINGLETON:
+                value = dump_orm(value, nested)
+            else:
+                value = [dump_orm(item, nested) for item in value]
+        data[name] = value
+    return data